@@ -0,0 +1,145 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+
+import aiohttp
+
+# 添付ファイルを保存するディレクトリ（SHA-256 の先頭2文字のサブディレクトリに分けて保存する）
+MIRROR_DIR = os.getenv('ATTACHMENT_MIRROR_DIR', 'attachments')
+# 同時にダウンロードするファイル数
+MIRROR_CONCURRENCY = int(os.getenv('ATTACHMENT_MIRROR_CONCURRENCY', 4))
+# これより大きいファイルは保存しない
+MIRROR_MAX_BYTES = int(os.getenv('ATTACHMENT_MIRROR_MAX_BYTES', 100 * 1024 * 1024))
+# ダウンロード時に一度に読み書きするサイズ
+CHUNK_SIZE = 64 * 1024
+
+
+def blob_path(sha256):
+    """ブロブの保存先（MIRROR_DIR からの相対パス）"""
+    return f"{sha256[:2]}/{sha256}"
+
+
+class AttachmentMirror:
+    """
+    添付ファイルをダウンロードして SHA-256 をキーにローカルへ保存する（同じ内容のファイルは1つだけ保存）
+    ダウンロードは共有のセッション（接続を再利用）で、同時に concurrency 件まで、ディスクに直接書き出す
+    """
+
+    def __init__(self, index, directory=MIRROR_DIR, concurrency=MIRROR_CONCURRENCY, max_bytes=MIRROR_MAX_BYTES):
+        self.index = index
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.concurrency = concurrency
+        self.session = None
+        # 同じ添付ファイルを同時にダウンロードしないように、ダウンロード中のものを共有する
+        # フォーマット: {attachment_id: Future}
+        self.downloading = {}
+
+        # 統計カウンター
+        self.downloaded = 0
+        self.downloaded_bytes = 0
+        self.deduplicated = 0
+        self.cached = 0
+        self.skipped = 0
+        self.failures = 0
+
+    def _get_session(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.concurrency),
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=60),
+            )
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def _entry(self, attachment, sha256, size):
+        return {
+            'id': str(attachment.id),
+            'filename': attachment.filename,
+            'size': size,
+            'content_type': attachment.content_type,
+            'sha256': sha256,
+            'path': blob_path(sha256) if sha256 else None,
+        }
+
+    async def mirror(self, attachment):
+        """
+        添付ファイルを保存して、保存先を含む辞書を返す
+        大きすぎるファイルやダウンロードに失敗した場合は path が None の辞書を返す
+        """
+        row = self.index.get(attachment.id)
+        if row is not None and os.path.exists(os.path.join(self.directory, blob_path(row[0]))):
+            self.cached += 1
+            return self._entry(attachment, row[0], row[1])
+        if attachment.size > self.max_bytes:
+            self.skipped += 1
+            return self._entry(attachment, None, attachment.size)
+
+        future = self.downloading.get(attachment.id)
+        if future is None:
+            future = asyncio.ensure_future(self._download(attachment))
+            self.downloading[attachment.id] = future
+            future.add_done_callback(lambda _: self.downloading.pop(attachment.id, None))
+        try:
+            sha256, size = await asyncio.shield(future)
+        except Exception as e:
+            self.failures += 1
+            print(f"添付ファイルの保存に失敗 ({attachment.filename}): {e}")
+            return self._entry(attachment, None, attachment.size)
+        return self._entry(attachment, sha256, size)
+
+    async def mirror_all(self, attachments):
+        """メッセージの添付ファイルをまとめて保存"""
+        return list(await asyncio.gather(*(self.mirror(attachment) for attachment in attachments)))
+
+    async def _download(self, attachment):
+        """一時ファイルにストリーミングで書き出しながらハッシュを計算し、ブロブとして保存する"""
+        os.makedirs(self.directory, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        async with self.semaphore:
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.part')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    async with self._get_session().get(attachment.url) as response:
+                        response.raise_for_status()
+                        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                            size += len(chunk)
+                            if size > self.max_bytes:
+                                raise ValueError(f"{self.max_bytes}バイトを超えています")
+                            digest.update(chunk)
+                            f.write(chunk)
+                sha256 = digest.hexdigest()
+                path = os.path.join(self.directory, blob_path(sha256))
+                if os.path.exists(path):
+                    # 同じ内容のファイルが既にある（再投稿された画像など）
+                    os.remove(temp_path)
+                    self.deduplicated += 1
+                else:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.replace(temp_path, path)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+        self.index.add(attachment.id, sha256, size, attachment.filename, attachment.content_type)
+        self.downloaded += 1
+        self.downloaded_bytes += size
+        return sha256, size
+
+    def stats(self):
+        """統計情報を辞書で返す"""
+        return {
+            'downloaded': self.downloaded,
+            'downloaded_bytes': self.downloaded_bytes,
+            'deduplicated': self.deduplicated,
+            'cached': self.cached,
+            'skipped': self.skipped,
+            'failures': self.failures,
+        }
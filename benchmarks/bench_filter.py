@@ -0,0 +1,52 @@
+"""
+on_message の監視チャンネル判定のベンチマーク
+
+従来の str キー + 文字列リストの判定と LoggingConfig（int キー + frozenset）を比較する
+
+    python benchmarks/bench_filter.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from logging_config import LoggingConfig  # noqa: E402
+
+GUILD_ID = 100000000000000001
+CHANNEL_BASE = 200000000000000000
+
+
+def legacy_check(continuous_logging, guild_id, channel_id):
+    """変更前の on_message の判定"""
+    if str(guild_id) in continuous_logging:
+        log_config = continuous_logging[str(guild_id)]
+        return not log_config['channels'] or str(channel_id) in log_config['channels']
+    return False
+
+
+def current_check(continuous_logging, guild_id, channel_id):
+    """LoggingConfig を使った判定"""
+    log_config = continuous_logging.get(guild_id)
+    return log_config is not None and log_config.watches(channel_id)
+
+
+def main():
+    number = 200000
+    print(f'{"チャンネル数":>10} {"従来(ns)":>10} {"現在(ns)":>10}')
+    for channel_count in (1, 10, 100, 500):
+        channel_ids = [CHANNEL_BASE + i for i in range(channel_count)]
+        # 最悪ケース: 監視リストの最後のチャンネル
+        channel_id = channel_ids[-1]
+
+        legacy_logging = {str(GUILD_ID): {'channels': [str(ch) for ch in channel_ids]}}
+        current_logging = {GUILD_ID: LoggingConfig(GUILD_ID, 0, 0, channel_ids)}
+        assert legacy_check(legacy_logging, GUILD_ID, channel_id) == current_check(current_logging, GUILD_ID, channel_id)
+
+        legacy = min(timeit.repeat(lambda: legacy_check(legacy_logging, GUILD_ID, channel_id), number=number, repeat=3))
+        current = min(timeit.repeat(lambda: current_check(current_logging, GUILD_ID, channel_id), number=number, repeat=3))
+        print(f'{channel_count:>10} {legacy / number * 1e9:>10.0f} {current / number * 1e9:>10.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,510 @@
+"""
+オフラインの負荷試験
+
+Discord の REST API を模したローカルサーバー（遅延とレート制限ヘッダー・429 を再現）を立て、
+discord.py の HTTP クライアントをそこに向けた上で main.py のハンドラーをそのまま動かす
+ゲートウェイの代わりに合成した MESSAGE_CREATE を ConnectionState に流し込み、次の値を出力する
+
+- on_message の処理速度（メッセージ/秒）と、受信からログチャンネルに届くまでの遅延（p50/p99）
+- 一部のサーバーの送信先だけが遅い場合の、他のサーバーの送信速度と遅延（--slow-guilds）
+- 継続ログを設定したサーバー1つあたりのメモリ使用量
+- /export の所要時間（履歴 1万〜100万件）
+
+外部への通信は行わない（データベース・ジャーナル・退避ファイルは一時ディレクトリに作る）
+偽サーバーも同じイベントループで動くので、本番より処理速度は低めに出る
+
+    python benchmarks/bench_load.py
+    python benchmarks/bench_load.py --messages 50000 --rate 5000 --export-sizes 10000,100000,1000000
+    python benchmarks/bench_load.py --slow-guilds 1 --slow-latency 1 --export-sizes ''
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import discord
+from aiohttp import web
+
+# main.py が作るファイルは一時ディレクトリに置く（import 前に設定する）
+WORK_DIR = tempfile.mkdtemp(prefix='bench_load_')
+os.environ['BOT_DB_PATH'] = os.path.join(WORK_DIR, 'bot_state.db')
+os.environ['ARCHIVE_DB_PATH'] = os.path.join(WORK_DIR, 'archive.db')
+os.environ['JOURNAL_DIR'] = os.path.join(WORK_DIR, 'journal')
+os.environ['LOG_SPILL_DIR'] = os.path.join(WORK_DIR, 'spill')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import main  # noqa: E402
+import metrics  # noqa: E402
+from logging_config import LoggingConfig  # noqa: E402
+
+BOT_ID = 100000000000000000
+USER_BASE = 300000000000000000
+AUTHOR_COUNT = 50
+CHANNELS_PER_GUILD = 5
+# 合成するIDの元になる時刻（メッセージIDはここから1ミリ秒ずつ増やす）
+EPOCH_ID = discord.utils.time_snowflake(datetime(2024, 1, 1, tzinfo=timezone.utc))
+FOOTER_ID = re.compile(r'メッセージID: (\d+)')
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def rss_bytes():
+    """現在のプロセスの RSS（/proc がない環境では最大 RSS）"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def user_payload(user_id):
+    return {'id': str(user_id), 'username': f'user{user_id % 1000}', 'discriminator': '0', 'global_name': None, 'avatar': None}
+
+
+AUTHORS = [user_payload(USER_BASE + i) for i in range(AUTHOR_COUNT)]
+AUTHOR_MEMBERS = [{'roles': [], 'joined_at': '2024-01-01T00:00:00+00:00', 'deaf': False, 'mute': False, 'flags': 0}] * AUTHOR_COUNT
+
+
+def message_payload(message_id, channel_id, guild_id=None, index=0):
+    data = {
+        'id': str(message_id),
+        'channel_id': str(channel_id),
+        'author': AUTHORS[index % AUTHOR_COUNT],
+        'content': f'load test message {index} ' + 'lorem ipsum ' * (index % 8),
+        'timestamp': discord.utils.snowflake_time(message_id).isoformat(),
+        'edited_timestamp': None,
+        'tts': False,
+        'mention_everyone': False,
+        'mentions': [],
+        'mention_roles': [],
+        'attachments': [],
+        'embeds': [],
+        'pinned': False,
+        'type': 0,
+    }
+    if guild_id is not None:
+        data['guild_id'] = str(guild_id)
+        data['member'] = AUTHOR_MEMBERS[index % AUTHOR_COUNT]
+    return data
+
+
+def guild_payload(guild_id, name, channel_ids):
+    """Botが管理者として参加しているサーバーの GUILD_CREATE"""
+    return {
+        'id': str(guild_id),
+        'name': name,
+        'owner_id': str(USER_BASE),
+        'member_count': 1,
+        'roles': [{
+            'id': str(guild_id), 'name': '@everyone', 'permissions': '8',
+            'position': 0, 'color': 0, 'hoist': False, 'managed': False, 'mentionable': False,
+        }],
+        'channels': [{
+            'id': str(channel_id), 'type': 0, 'name': f'channel-{i}', 'position': i, 'permission_overwrites': [],
+        } for i, channel_id in enumerate(channel_ids)],
+        'members': [{'user': user_payload(BOT_ID), 'roles': [], 'joined_at': '2024-01-01T00:00:00+00:00', 'deaf': False, 'mute': False, 'flags': 0}],
+        'presences': [],
+        'voice_states': [],
+        'emojis': [],
+        'stickers': [],
+        'features': [],
+        'large': False,
+    }
+
+
+def json_response(data, status, headers):
+    """discord.py は Content-Type が application/json と完全に一致する場合だけ JSON として読む"""
+    headers['Content-Type'] = 'application/json'
+    return web.Response(body=json.dumps(data).encode('utf-8'), status=status, headers=headers)
+
+
+class FakeDiscord:
+    """
+    Discord の REST API を模したローカルサーバー
+    ルート（メソッド + パス）ごとに window 秒あたり limit 回のレート制限があり、
+    X-RateLimit-* ヘッダーを返して使い切ったら 429 を返す
+    """
+
+    def __init__(self, latency, limit, window, error_rate=0.0):
+        self.latency = latency
+        self.limit = limit
+        self.window = window
+        # レート制限に関係なく 429 を返す割合（サブレート制限の再現）
+        self.error_rate = error_rate
+        # フォーマット: {channel_id: 履歴のメッセージ数}
+        self.histories = {}
+        # フォーマット: {channel_id: guild_id}
+        self.guild_ids = {}
+        # フォーマット: {message_id: 受信した時刻}
+        self.dispatched = {}
+        self.latencies = []
+        # フォーマット: {channel_id: [遅延]}
+        self.channel_latencies = {}
+        # 応答を slow_latency 秒遅らせる送信先チャンネル（遅い・レート制限中の送信先の再現）
+        self.slow_channels = set()
+        self.slow_latency = 0.0
+        # フォーマット: {bucket: [窓の開始時刻, 使った回数]}
+        self.buckets = {}
+        self.requests = 0
+        self.rate_limited = 0
+        self.uploaded_bytes = 0
+        self.uploads = 0
+        self.runner = None
+
+        self.app = web.Application(client_max_size=64 * 1024 * 1024)
+        self.app.router.add_get('/api/v10/users/@me', self.get_me)
+        self.app.router.add_post('/api/v10/channels/{channel_id}/messages', self.create_message)
+        self.app.router.add_get('/api/v10/channels/{channel_id}/messages', self.get_messages)
+
+    async def start(self):
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        # discord.py のリクエスト先をこのサーバーに向ける
+        discord.http.Route.BASE = f'http://127.0.0.1:{port}/api/v10'
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    async def _respond(self, request, bucket, handler, latency=None):
+        self.requests += 1
+        latency = self.latency if latency is None else latency
+        await asyncio.sleep(random.uniform(latency * 0.5, latency * 1.5))
+        now = time.monotonic()
+        state = self.buckets.get(bucket)
+        if state is None or now - state[0] >= self.window:
+            state = [now, 0]
+            self.buckets[bucket] = state
+        reset_after = max(self.window - (now - state[0]), 0.001)
+        headers = {
+            'X-RateLimit-Limit': str(self.limit),
+            'X-RateLimit-Reset': f'{time.time() + reset_after:.3f}',
+            'X-RateLimit-Reset-After': f'{reset_after:.3f}',
+            'X-RateLimit-Bucket': str(abs(hash(bucket.split(':')[0]))),
+            'Via': '1.1 google',
+        }
+        if state[1] >= self.limit or random.random() < self.error_rate:
+            self.rate_limited += 1
+            headers['X-RateLimit-Remaining'] = str(max(self.limit - state[1], 0))
+            headers['X-RateLimit-Scope'] = 'user'
+            headers['Retry-After'] = f'{reset_after:.3f}'
+            return json_response({'message': 'You are being rate limited.', 'retry_after': reset_after, 'global': False}, 429, headers)
+        state[1] += 1
+        headers['X-RateLimit-Remaining'] = str(self.limit - state[1])
+        return json_response(await handler(), 200, headers)
+
+    async def get_me(self, request):
+        async def handler():
+            return dict(user_payload(BOT_ID), bot=True)
+        return await self._respond(request, 'me', handler)
+
+    async def create_message(self, request):
+        channel_id = int(request.match_info['channel_id'])
+
+        async def handler():
+            if request.content_type.startswith('multipart/'):
+                body = await request.read()
+                self.uploads += 1
+                self.uploaded_bytes += len(body)
+            else:
+                payload = await request.json()
+                received = time.perf_counter()
+                for embed in payload.get('embeds') or []:
+                    match = FOOTER_ID.search((embed.get('footer') or {}).get('text', ''))
+                    if match:
+                        started = self.dispatched.pop(int(match.group(1)), None)
+                        if started is not None:
+                            self.latencies.append(received - started)
+                            self.channel_latencies.setdefault(channel_id, []).append(received - started)
+            message_id = discord.utils.time_snowflake(datetime.now(timezone.utc))
+            data = message_payload(message_id, channel_id)
+            data['author'] = dict(user_payload(BOT_ID), bot=True)
+            return data
+        latency = self.slow_latency if channel_id in self.slow_channels else None
+        return await self._respond(request, f'post_messages:{channel_id}', handler, latency)
+
+    async def get_messages(self, request):
+        """履歴は新しい順に返す（ID は EPOCH_ID + i ミリ秒、i=0 が最も古い）"""
+        channel_id = int(request.match_info['channel_id'])
+
+        async def handler():
+            count = self.histories.get(channel_id, 0)
+            limit = min(int(request.query.get('limit', 50)), 100)
+            before = request.query.get('before')
+            end = count if before is None else min(count, max(0, ((int(before) - EPOCH_ID) >> 22)))
+            guild_id = self.guild_ids.get(channel_id)
+            return [
+                message_payload(EPOCH_ID + (i << 22), channel_id, guild_id, i)
+                for i in range(end - 1, max(end - limit, 0) - 1, -1)
+            ]
+        return await self._respond(request, f'get_messages:{channel_id}', handler)
+
+
+class FakeInteraction:
+    """スラッシュコマンドのハンドラーに渡す Interaction の代わり"""
+
+    def __init__(self, guild, channel):
+        self.guild = guild
+        self.channel = channel
+        self.user = SimpleNamespace(id=USER_BASE, guild_permissions=discord.Permissions.all(), mention='@bench')
+        self.response = SimpleNamespace(defer=self._noop)
+        self.followup = SimpleNamespace(send=self._followup)
+        self.replies = []
+
+    async def _noop(self, *args, **kwargs):
+        pass
+
+    async def _followup(self, content=None, **kwargs):
+        self.replies.append(content)
+        return SimpleNamespace(edit=self._noop)
+
+
+async def setup_bot(fake):
+    """main.bot を偽サーバーにログインさせる（ゲートウェイには接続しない）"""
+    bot = main.bot
+    await bot._async_setup_hook()
+    data = await bot.http.static_login('bench-token')
+    state = bot._connection
+    state.user = discord.ClientUser(state=state, data=data)
+    return state
+
+
+def add_guild(state, guild_id, name, channel_ids):
+    return state._add_guild_from_data(guild_payload(guild_id, name, channel_ids))
+
+
+async def bench_logging(fake, state, guild_count, message_count, rate, slow_guilds=0, slow_latency=0.0):
+    """
+    継続ログの負荷試験（サーバーごとに別のログサーバーへ送信）
+    最初の slow_guilds 個のサーバーは送信先の応答を slow_latency 秒にして、残りのサーバーへの影響を計測する
+    """
+    guild_base = 200000000000000000
+    log_base = 500000000000000000
+    guilds = []
+
+    # 継続ログの設定と最初のメッセージまでに増えるメモリ（ジャーナル・送信キューなど）を計測
+    tracemalloc.start()
+    rss_before = rss_bytes()
+    for g in range(guild_count):
+        guild_id = guild_base + g * 1000
+        log_id = log_base + g * 1000
+        guild = add_guild(state, guild_id, f'guild-{g}', [guild_id + 1 + c for c in range(CHANNELS_PER_GUILD)])
+        log_server = add_guild(state, log_id, f'log-{g}', [log_id + 1])
+        log_channel = main.destination_resolver.resolve(log_server)
+        main.continuous_logging[guild_id] = LoggingConfig(guild_id, log_id, log_channel.id, (), 'embed', log_channel)
+        guilds.append(guild)
+    traced_setup, _ = tracemalloc.get_traced_memory()
+    message_id = EPOCH_ID
+    for g, guild in enumerate(guilds):
+        message_id += 1 << 22
+        state.parse_message_create(message_payload(message_id, guild.text_channels[0].id, guild.id, g))
+    await asyncio.sleep(0.1)
+    traced, _ = tracemalloc.get_traced_memory()
+    rss_after = rss_bytes()
+    tracemalloc.stop()
+
+    # 処理済み件数と on_message の処理時間を記録するために登録済みのハンドラーを包む
+    handled = []
+    handler_seconds = []
+    on_message = main.on_message
+
+    async def timed_on_message(message):
+        started = time.perf_counter()
+        await on_message(message)
+        handler_seconds.append(time.perf_counter() - started)
+        handled.append(message.id)
+
+    main.bot.on_message = timed_on_message
+
+    fake.slow_latency = slow_latency
+    fake.slow_channels = {main.continuous_logging[guild.id].log_channel_id for guild in guilds[:slow_guilds]}
+
+    # ゲートウェイの代わりに MESSAGE_CREATE を一定のペースで流し込む
+    channels = [(guild.id, channel.id) for guild in guilds for channel in guild.text_channels]
+    interval = 1 / rate if rate else 0
+    started = time.perf_counter()
+    for i in range(message_count):
+        message_id += 1 << 22
+        guild_id, channel_id = channels[i % len(channels)]
+        fake.dispatched[message_id] = time.perf_counter()
+        state.parse_message_create(message_payload(message_id, channel_id, guild_id, i))
+        if interval:
+            delay = started + (i + 1) * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        elif i % 100 == 0:
+            await asyncio.sleep(0)
+    while len(handled) < message_count:
+        await asyncio.sleep(0.01)
+    ingest_seconds = time.perf_counter() - started
+
+    # 遅い送信先以外のサーバーの処理と送信が終わるまで待つ
+    slow_ids = {guild.id for guild in guilds[:slow_guilds]}
+    healthy_channels = {main.continuous_logging[guild.id].log_channel_id for guild in guilds if guild.id not in slow_ids}
+    await asyncio.gather(*(pipeline.join() for guild_id, pipeline in main.pipelines.items() if guild_id not in slow_ids))
+    await asyncio.gather(*(queue.queue.join() for channel_id, queue in main.log_queues.items() if channel_id in healthy_channels))
+    healthy_seconds = time.perf_counter() - started
+    healthy_latencies = [latency for channel_id in healthy_channels for latency in fake.channel_latencies.get(channel_id, ())]
+    slow_pipelines = [main.pipelines[guild_id].stats() for guild_id in slow_ids if guild_id in main.pipelines]
+
+    # 遅い送信先を元に戻して、残りがすべて送り終わるまで待つ
+    fake.slow_channels = set()
+    await asyncio.gather(*(pipeline.join() for pipeline in main.pipelines.values()))
+    await asyncio.gather(*(queue.queue.join() for queue in main.log_queues.values()))
+    delivered_seconds = time.perf_counter() - started
+    main.bot.on_message = on_message
+
+    stats = [queue.stats() for queue in main.log_queues.values()]
+    return {
+        'guilds': guild_count,
+        'messages': message_count,
+        'ingest_rate': message_count / ingest_seconds,
+        'delivered_rate': len(fake.latencies) / delivered_seconds,
+        'handler_p50': percentile(handler_seconds, 0.5),
+        'handler_p99': percentile(handler_seconds, 0.99),
+        'latency_p50': percentile(fake.latencies, 0.5),
+        'latency_p99': percentile(fake.latencies, 0.99),
+        'delivered': len(fake.latencies),
+        'healthy_rate': len(healthy_latencies) / healthy_seconds,
+        'healthy_p50': percentile(healthy_latencies, 0.5),
+        'healthy_p99': percentile(healthy_latencies, 0.99),
+        'slow_lag': max((s['lag'] for s in slow_pipelines), default=0.0),
+        'slow_queued': sum(s['queued'] for s in slow_pipelines),
+        'dropped': sum(s['dropped'] for s in stats),
+        'spilled': sum(s['spilled'] for s in stats),
+        'traced_per_guild': (traced - traced_setup) / guild_count,
+        'traced_setup_per_guild': traced_setup / guild_count,
+        'rss_per_guild': (rss_after - rss_before) / guild_count,
+    }
+
+
+async def bench_export(fake, state, sizes, compression, export_format):
+    """/export の所要時間（履歴の件数ごと）"""
+    source_id = 700000000000000000
+    log_id = 800000000000000000
+    channel_ids = [source_id + 1 + i for i in range(len(sizes))]
+    source = add_guild(state, source_id, 'export-source', channel_ids)
+    log_server = add_guild(state, log_id, 'export-log', [log_id + 1])
+    fake.guild_ids.update((channel_id, source_id) for channel_id in channel_ids)
+
+    results = []
+    for channel_id, size in zip(channel_ids, sizes):
+        fake.histories[channel_id] = size
+        uploads, uploaded_bytes, requests = fake.uploads, fake.uploaded_bytes, fake.requests
+        interaction = FakeInteraction(source, source.get_channel(channel_id))
+        started = time.perf_counter()
+        await main.export_log.callback(interaction, str(log_server.id), str(channel_id), size, compression, export_format)
+        # /export はジョブを登録してすぐに返るので、ジョブが終わるまで待つ
+        failed = [reply for reply in interaction.replies if reply and reply.startswith('❌')]
+        if not failed:
+            job = main.export_scheduler.jobs[max(main.export_scheduler.jobs)]
+            # 終了の通知を送り終わるまで待つ
+            while not job.finished or main.export_scheduler.running:
+                await asyncio.sleep(0.01)
+            if job.status != 'done':
+                failed.append(f'❌ {job.error}')
+        elapsed = time.perf_counter() - started
+        results.append({
+            'size': size,
+            'seconds': elapsed,
+            'rate': size / elapsed,
+            'requests': fake.requests - requests,
+            'parts': fake.uploads - uploads,
+            'uploaded_bytes': fake.uploaded_bytes - uploaded_bytes,
+            'error': failed[0] if failed else None,
+        })
+    return results
+
+
+async def run(args):
+    limit, window = args.rate_limit.split('/')
+    fake = FakeDiscord(args.latency, int(limit), float(window), args.error_rate)
+    await fake.start()
+    try:
+        state = await setup_bot(fake)
+
+        print(f'レート制限: {limit}回/{window}秒, 遅延: {args.latency * 1000:.0f}ms, 429の割合: {args.error_rate:.1%}')
+        if args.messages:
+            result = await bench_logging(fake, state, args.guilds, args.messages, args.rate, args.slow_guilds, args.slow_latency)
+            print()
+            print(f'継続ログ（サーバー {result["guilds"]}, メッセージ {result["messages"]}, 投入ペース {f"{args.rate:g}" if args.rate else "無制限"}件/秒）')
+            print(f'  on_message 処理速度   {result["ingest_rate"]:>10.0f} 件/秒')
+            print(f'  on_message 処理時間   p50 {result["handler_p50"] * 1e6:>8.0f}µs  p99 {result["handler_p99"] * 1e6:>8.0f}µs')
+            print(f'  ログ送信まで          {result["delivered_rate"]:>10.0f} 件/秒 ({result["delivered"]}件, 破棄 {result["dropped"]}, 退避 {result["spilled"]})')
+            print(f'  送信遅延              p50 {result["latency_p50"] * 1000:>8.1f}ms  p99 {result["latency_p99"] * 1000:>8.1f}ms')
+            if args.slow_guilds:
+                print(f'  遅い送信先 {args.slow_guilds}個（応答 {args.slow_latency * 1000:.0f}ms）')
+                print(f'    他のサーバー        {result["healthy_rate"]:>10.0f} 件/秒  p50 {result["healthy_p50"] * 1000:>8.1f}ms  p99 {result["healthy_p99"] * 1000:>8.1f}ms')
+                print(f'    遅いサーバー        処理待ち {result["slow_queued"]}件  最も古いもの {result["slow_lag"]:.1f}秒前（他のサーバーの送信完了時）')
+            print(f'  メモリ/サーバー       設定 {result["traced_setup_per_guild"] / 1024:>8.1f}KiB  初回メッセージ後 +{result["traced_per_guild"] / 1024:.1f}KiB (tracemalloc)'
+                  f'  RSS {result["rss_per_guild"] / 1024:.1f}KiB')
+
+        sizes = [int(size) for size in args.export_sizes.split(',') if size]
+        if sizes:
+            print()
+            print(f'/export（形式: {args.format}, 圧縮: {args.compression}）')
+            print(f'{"件数":>10} {"時間(秒)":>10} {"件/秒":>10} {"リクエスト":>10} {"パート":>6} {"送信(MiB)":>10}')
+            for result in await bench_export(fake, state, sizes, args.compression, args.format):
+                print(f'{result["size"]:>10} {result["seconds"]:>10.2f} {result["rate"]:>10.0f} {result["requests"]:>10} '
+                      f'{result["parts"]:>6} {result["uploaded_bytes"] / 1024 / 1024:>10.1f}'
+                      + (f'  {result["error"]}' if result['error'] else ''))
+
+        print()
+        print(f'偽サーバーへのリクエスト {fake.requests}回, 429 {fake.rate_limited}回, 送信の再試行 {sum(metrics.send_retries.values.values())}回')
+    finally:
+        for worker in main.export_scheduler.workers:
+            worker.cancel()
+        for pipeline in list(main.pipelines.values()):
+            await pipeline.close()
+        for queue in list(main.log_queues.values()):
+            await queue.close()
+        for journal in main.journals.values():
+            journal.seal()
+        await main.bot.http.close()
+        await fake.stop()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='Discord を模したローカルサーバーでの負荷試験')
+    parser.add_argument('--guilds', type=int, default=10, help='継続ログを設定するサーバー数')
+    parser.add_argument('--messages', type=int, default=20000, help='流し込むメッセージ数（0 で継続ログの試験を省略）')
+    parser.add_argument('--rate', type=float, default=1000, help='1秒あたりに流し込むメッセージ数（0 で無制限）')
+    parser.add_argument('--latency', type=float, default=0.02, help='偽サーバーの応答遅延（秒）')
+    parser.add_argument('--rate-limit', default='50/1', help='ルートごとのレート制限（回数/秒）')
+    parser.add_argument('--error-rate', type=float, default=0.01, help='レート制限とは別に 429 を返す割合')
+    parser.add_argument('--slow-guilds', type=int, default=0, help='送信先の応答を遅くするサーバー数')
+    parser.add_argument('--slow-latency', type=float, default=1.0, help='遅い送信先の応答遅延（秒）')
+    parser.add_argument('--export-sizes', default='10000,100000', help='/export する履歴の件数（カンマ区切り、空で省略）')
+    parser.add_argument('--compression', default='none', choices=['none', 'gzip', 'zstd'])
+    parser.add_argument('--format', default='json', choices=['json', 'ndjson', 'csv', 'parquet'])
+    args = parser.parse_args()
+    try:
+        asyncio.run(run(args))
+    finally:
+        shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main_cli()
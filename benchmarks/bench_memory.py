@@ -0,0 +1,176 @@
+"""
+メモリ使用量のベンチマーク
+
+大規模サーバーを模した GUILD_CREATE と MESSAGE_CREATE を discord.py のキャッシュに直接流し込み、
+通常の設定と LOW_MEMORY=1 の設定で RSS の増加量を比較する（設定ごとに別プロセスで計測）
+
+    python benchmarks/bench_memory.py [メンバー数] [メッセージ数]
+"""
+import os
+import subprocess
+import sys
+import tracemalloc
+
+import discord
+
+GUILD_ID = 100000000000000001
+CHANNEL_BASE = 200000000000000000
+USER_BASE = 300000000000000000
+MESSAGE_BASE = 400000000000000000
+BOT_ID = USER_BASE - 1
+CHANNEL_COUNT = 50
+
+
+def rss_bytes():
+    """現在のプロセスの RSS（/proc がない環境では最大 RSS）"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def user_payload(user_id):
+    return {
+        'id': str(user_id),
+        'username': f'user{user_id % 1000000}',
+        'discriminator': '0',
+        'global_name': f'User {user_id % 1000000}',
+        'avatar': None,
+    }
+
+
+def member_payload(user_id):
+    return {
+        'user': user_payload(user_id),
+        'nick': None,
+        'roles': [],
+        'joined_at': '2024-01-01T00:00:00+00:00',
+        'deaf': False,
+        'mute': False,
+        'flags': 0,
+    }
+
+
+def guild_payload(member_count):
+    """メンバー一覧を含む GUILD_CREATE のペイロード（チャンク取得後の状態に相当）"""
+    members = [member_payload(BOT_ID)] + [member_payload(USER_BASE + i) for i in range(member_count)]
+    return {
+        'id': str(GUILD_ID),
+        'name': 'benchmark',
+        'owner_id': str(USER_BASE),
+        'member_count': member_count + 1,
+        'roles': [{
+            'id': str(GUILD_ID), 'name': '@everyone', 'permissions': '1071698660929',
+            'position': 0, 'color': 0, 'hoist': False, 'managed': False, 'mentionable': False,
+        }],
+        'channels': [{
+            'id': str(CHANNEL_BASE + i), 'type': 0, 'name': f'channel-{i}', 'position': i,
+            'permission_overwrites': [],
+        } for i in range(CHANNEL_COUNT)],
+        'members': members,
+        'presences': [],
+        'voice_states': [],
+        'emojis': [],
+        'stickers': [],
+        'features': [],
+        'large': True,
+    }
+
+
+def message_payload(index, member_count):
+    user_id = USER_BASE + index % member_count
+    return {
+        'id': str(MESSAGE_BASE + index),
+        'channel_id': str(CHANNEL_BASE + index % CHANNEL_COUNT),
+        'guild_id': str(GUILD_ID),
+        'author': user_payload(user_id),
+        'member': {k: v for k, v in member_payload(user_id).items() if k != 'user'},
+        'content': f'benchmark message {index} ' + 'x' * 80,
+        'timestamp': '2024-01-01T00:00:00+00:00',
+        'edited_timestamp': None,
+        'tts': False,
+        'mention_everyone': False,
+        'mentions': [],
+        'mention_roles': [],
+        'attachments': [],
+        'embeds': [],
+        'pinned': False,
+        'type': 0,
+    }
+
+
+def make_client(low_memory):
+    """main.py と同じ設定の Client（ログインはしない）"""
+    intents = discord.Intents.default()
+    intents.message_content = True
+    intents.guilds = True
+    intents.members = True
+    options = {}
+    if low_memory:
+        intents.members = False
+        intents.presences = False
+        intents.typing = False
+        intents.voice_states = False
+        intents.invites = False
+        intents.integrations = False
+        intents.webhooks = False
+        intents.emojis_and_stickers = False
+        intents.guild_scheduled_events = False
+        intents.auto_moderation = False
+        options = {
+            'chunk_guilds_at_startup': False,
+            'member_cache_flags': discord.MemberCacheFlags.none(),
+            'max_messages': None,
+        }
+    return discord.Client(intents=intents, **options)
+
+
+def measure(low_memory, member_count, message_count):
+    """1つの設定で計測して 'RSS増加 tracemalloc メンバー数 メッセージ数' を出力する"""
+    client = make_client(low_memory)
+    state = client._connection
+    state.dispatch = lambda *args, **kwargs: None
+    state.user = discord.ClientUser(state=state, data=user_payload(BOT_ID))
+
+    # ペイロードの生成分は計測に含めない
+    guild_data = guild_payload(member_count)
+    messages = [message_payload(i, member_count) for i in range(message_count)]
+
+    tracemalloc.start()
+    before = rss_bytes()
+    guild = state._add_guild_from_data(guild_data)
+    for data in messages:
+        state.parse_message_create(data)
+    after = rss_bytes()
+    traced, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert guild.me is not None
+    cached_messages = len(state._messages) if state._messages is not None else 0
+    print(after - before, traced, len(guild._members), cached_messages)
+
+
+def main():
+    member_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    message_count = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    print(f'メンバー数 {member_count}, メッセージ数 {message_count}')
+    print(f'{"設定":<10} {"RSS増加(MiB)":>14} {"割り当て(MiB)":>14} {"メンバー":>10} {"メッセージ":>10}')
+    for name, low_memory in (('通常', False), ('LOW_MEMORY', True)):
+        output = subprocess.check_output([
+            sys.executable, os.path.abspath(__file__), '--measure',
+            str(int(low_memory)), str(member_count), str(message_count),
+        ], text=True)
+        rss, traced, members, cached = (int(value) for value in output.split())
+        print(f'{name:<10} {rss / 1024 / 1024:>14.1f} {traced / 1024 / 1024:>14.1f} {members:>10} {cached:>10}')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--measure':
+        measure(sys.argv[2] == '1', int(sys.argv[3]), int(sys.argv[4]))
+    else:
+        main()
@@ -0,0 +1,124 @@
+"""
+メッセージシリアライザーのマイクロベンチマーク
+
+従来の on_message / export 内のインライン辞書構築と serializer モジュールを
+合成メッセージで比較する
+
+    python benchmarks/bench_serializer.py [メッセージ数]
+"""
+import os
+import sys
+import timeit
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import discord
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from serializer import MessageSerializer  # noqa: E402
+
+
+class FakeUser:
+    """discord.Member の代わりに使う投稿者"""
+
+    def __init__(self, user_id, name):
+        self.id = user_id
+        self.name = name
+        self.display_name = name.title()
+
+    def __str__(self):
+        return self.name
+
+
+def make_messages(count, embed_ratio=0.05):
+    """合成メッセージを生成（embed_ratio の割合で埋め込み付き）"""
+    guild = SimpleNamespace(id=100000000000000001, name='bench-guild')
+    channel = SimpleNamespace(id=200000000000000001, name='general', guild=guild)
+    authors = [FakeUser(300000000000000000 + i, f'user{i}') for i in range(50)]
+    created_at = datetime.now(timezone.utc)
+    embed_every = int(1 / embed_ratio) if embed_ratio else 0
+
+    messages = []
+    for i in range(count):
+        embeds = []
+        if embed_every and i % embed_every == 0:
+            embed = discord.Embed(title='title', description='description', url='https://example.com', color=0x00ff00, timestamp=created_at)
+            embed.set_footer(text='footer')
+            embed.set_author(name='author')
+            embed.add_field(name='field', value='value')
+            embeds.append(embed)
+        messages.append(SimpleNamespace(
+            id=400000000000000000 + i,
+            channel=channel,
+            guild=guild,
+            author=authors[i % len(authors)],
+            webhook_id=None,
+            content=f'message {i} ' * 5,
+            created_at=created_at,
+            edited_at=None,
+            attachments=[],
+            embeds=embeds,
+            mentions=[],
+            reactions=[],
+        ))
+    return channel, guild, messages
+
+
+def legacy_serialize(message, target_channel):
+    """変更前の export_log 内のインライン辞書構築"""
+    return {
+        'id': str(message.id),
+        'channel': target_channel.name,
+        'channel_id': str(target_channel.id),
+        'guild': message.guild.name if message.guild else 'DM',
+        'guild_id': str(message.guild.id) if message.guild else None,
+        'author': str(message.author),
+        'author_id': str(message.author.id),
+        'display_name': message.author.display_name,
+        'is_webhook': message.webhook_id is not None,
+        'webhook_id': str(message.webhook_id) if message.webhook_id else None,
+        'content': message.content,
+        'timestamp': message.created_at.isoformat(),
+        'edited_at': message.edited_at.isoformat() if message.edited_at else None,
+        'attachments': [att.url for att in message.attachments],
+        'embeds': len(message.embeds),
+        'embed_details': [
+            {
+                'title': embed.title,
+                'description': embed.description,
+                'url': embed.url,
+                'color': embed.color.value if embed.color else None,
+                'timestamp': embed.timestamp.isoformat() if embed.timestamp else None,
+                'footer': {'text': embed.footer.text, 'icon_url': embed.footer.icon_url} if embed.footer else None,
+                'author': {'name': embed.author.name, 'url': embed.author.url, 'icon_url': embed.author.icon_url} if embed.author else None,
+                'thumbnail': embed.thumbnail.url if embed.thumbnail else None,
+                'image': embed.image.url if embed.image else None,
+                'fields': [{'name': field.name, 'value': field.value, 'inline': field.inline} for field in embed.fields]
+            } for embed in message.embeds
+        ],
+        'mentions': [str(user) for user in message.mentions],
+        'reactions': [{'emoji': str(reaction.emoji), 'count': reaction.count} for reaction in message.reactions]
+    }
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    channel, guild, messages = make_messages(count)
+    serializer = MessageSerializer(channel, guild)
+
+    # 出力が変わっていないことを確認
+    for message in messages[:100]:
+        assert serializer.serialize(message) == legacy_serialize(message, channel)
+
+    legacy = min(timeit.repeat(lambda: [legacy_serialize(m, channel) for m in messages], number=1, repeat=5))
+    current = min(timeit.repeat(lambda: [serializer.serialize(m) for m in messages], number=1, repeat=5))
+
+    print(f'メッセージ数: {count}')
+    print(f'従来:     {legacy / count * 1e6:.2f} µs/メッセージ')
+    print(f'serializer: {current / count * 1e6:.2f} µs/メッセージ')
+    print(f'高速化:   {legacy / current:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+import asyncio
+import json
+import os
+import random
+import time
+
+import aiohttp
+import discord
+
+# 送信に失敗した埋め込みを退避するディレクトリと、送信先ごとの上限（超えた分は破棄）
+SPILL_DIR = os.getenv('LOG_SPILL_DIR', 'spill')
+SPILL_MAX_BYTES = int(os.getenv('LOG_SPILL_MAX_BYTES', 64 * 1024 * 1024))
+
+# 再試行の回数と待ち時間（秒）
+MAX_RETRIES = 4
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 30.0
+# 1回の送信にかける時間の上限（秒、discord.py 内部の再試行も含めて、超えたら失敗として扱う）
+SEND_RETRY_BUDGET = float(os.getenv('LOG_SEND_RETRY_BUDGET', 30))
+
+
+def is_retryable(error):
+    """時間をおけば成功する可能性があるエラーか（429・5xx・通信エラー）"""
+    if isinstance(error, discord.RateLimited):
+        return True
+    if isinstance(error, discord.HTTPException):
+        return error.status == 429 or error.status >= 500
+    return isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError, OSError))
+
+
+def is_unavailable(error):
+    """送信先が使えない状態か（再試行はしないが、復旧を待って再送する）"""
+    return isinstance(error, (discord.Forbidden, discord.NotFound))
+
+
+def retry_delay(error, attempt):
+    """
+    再試行までの待ち時間
+    429 の場合は retry_after に従い、それ以外は指数バックオフにジッターを加える
+    """
+    retry_after = None
+    if isinstance(error, discord.RateLimited):
+        retry_after = error.retry_after
+    elif isinstance(error, discord.HTTPException) and error.status == 429:
+        try:
+            retry_after = float(error.response.headers.get('Retry-After'))
+        except (AttributeError, TypeError, ValueError):
+            pass
+    if retry_after is not None:
+        return retry_after + random.uniform(0, BACKOFF_BASE)
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+async def send_with_retry(send, max_retries=MAX_RETRIES, on_retry=None, budget=SEND_RETRY_BUDGET):
+    """
+    send() を呼び、再試行可能なエラーの間は待ってからやり直す
+    再試行しても失敗した場合や、待ち時間を含めて budget 秒を超える場合は最後の例外を送出する
+    （discord.py も 429 と一部の 5xx を内部で待って再試行するので、1回の send() ごとに残り時間で打ち切る）
+    """
+    deadline = time.monotonic() + budget if budget else None
+    attempt = 0
+    while True:
+        try:
+            if deadline is None:
+                return await send()
+            return await asyncio.wait_for(send(), max(0.0, deadline - time.monotonic()))
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+            delay = retry_delay(e, attempt)
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                raise
+            if on_retry is not None:
+                on_retry(e, delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+class CircuitBreaker:
+    """
+    送信先ごとのサーキットブレーカー
+    failure_threshold 回続けて失敗すると open になり、reset_timeout 秒後に1回だけ試行（half_open）する
+    試行が成功すれば closed に戻り、失敗すればまた open になる
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self.opens = 0
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if self.trial or time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self):
+        """送信してよいか（half_open の間は最初の1回だけ許可）"""
+        state = self.state
+        if state == 'closed':
+            return True
+        if state == 'half_open' and not self.trial:
+            self.trial = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.trial or (self.opened_at is None and self.failures >= self.failure_threshold):
+            if self.opened_at is None:
+                self.opens += 1
+            self.opened_at = time.monotonic()
+            self.trial = False
+
+
+class SpillQueue:
+    """
+    送信できなかった埋め込みを退避するディスク上のキュー（送信先ごとの改行区切りJSON）
+    再起動後も残っている分は次に同じ送信先のキューを作ったときに再送する
+    owner を指定するとファイル名の先頭に付ける（同じ送信先に書き込む別のプロセスとファイルを分ける）
+    """
+
+    def __init__(self, destination_id, directory=SPILL_DIR, max_bytes=SPILL_MAX_BYTES, owner=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        filename = f"{owner}_{destination_id}.ndjson" if owner else f"{destination_id}.ndjson"
+        self.path = os.path.join(directory, filename)
+        self.count = 0
+        self.size = 0
+        self.dropped = 0
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                for line in f:
+                    self.count += 1
+                    self.size += len(line)
+
+    def push(self, embeds):
+        """埋め込みを末尾に追加（上限を超える分は破棄）して、追加した件数を返す"""
+        lines = []
+        size = self.size
+        for embed in embeds:
+            line = json.dumps(embed.to_dict(), ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+            if size + len(line) > self.max_bytes:
+                self.dropped += 1
+                continue
+            lines.append(line)
+            size += len(line)
+        if lines:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.path, 'ab') as f:
+                f.writelines(lines)
+            self.count += len(lines)
+            self.size = size
+        return len(lines)
+
+    def load(self):
+        """退避している埋め込みを古い順に返す"""
+        if not self.count:
+            return []
+        with open(self.path, 'rb') as f:
+            return [discord.Embed.from_dict(json.loads(line)) for line in f if line.endswith(b'\n')]
+
+    def replace(self, embeds):
+        """再送できなかった埋め込みだけを残す"""
+        if not embeds:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self.count = 0
+            self.size = 0
+            return
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            for embed in embeds:
+                f.write(json.dumps(embed.to_dict(), ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n')
+            size = f.tell()
+        os.replace(temp_path, self.path)
+        self.count = len(embeds)
+        self.size = size
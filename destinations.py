@@ -0,0 +1,96 @@
+import discord
+
+
+def is_writable(channel, member=None):
+    """Botがチャンネルにメッセージを送信できるか（member を省略した場合はキャッシュの guild.me で判定）"""
+    return channel.permissions_for(member or channel.guild.me).send_messages
+
+
+class DestinationResolver:
+    """
+    ログサーバーごとの送信先チャンネルを解決してキャッシュする
+    管理者が固定したチャンネルがあればそれを使い、なければ最初の書き込み可能なテキストチャンネルを使う
+    チャンネル・ロールの変更で invalidate() されるまでは権限を計算し直さない
+    別のプロセスのシャードにあるログサーバー（キャッシュにないもの）は fetch() でRESTから解決する
+    """
+
+    def __init__(self, pin_store):
+        self.pin_store = pin_store
+        # フォーマット: {log_server_id: channel_id}
+        self.pins = pin_store.load_all()
+        # フォーマット: {log_server_id: channel_id}
+        self.cache = {}
+
+    def resolve(self, log_server):
+        """送信先チャンネルを返す（書き込み可能なチャンネルがなければ None）"""
+        channel_id = self.cache.get(log_server.id)
+        if channel_id is not None:
+            channel = log_server.get_channel(channel_id)
+            if channel is not None:
+                return channel
+
+        channel = None
+        pinned = log_server.get_channel(self.pins[log_server.id]) if log_server.id in self.pins else None
+        if pinned is not None and is_writable(pinned):
+            channel = pinned
+        else:
+            for candidate in log_server.text_channels:
+                if is_writable(candidate):
+                    channel = candidate
+                    break
+        if channel is not None:
+            self.cache[log_server.id] = channel.id
+        return channel
+
+    async def fetch(self, client, log_server_id):
+        """
+        キャッシュにないログサーバーと送信先チャンネルをRESTで取得して (ログサーバー, チャンネル) を返す
+        ログサーバーに参加していなければ (None, None)、書き込み可能なチャンネルがなければ (ログサーバー, None)
+        チャンネル・ロールの変更イベントが届かないので結果はキャッシュしない
+        """
+        try:
+            log_server = await client.fetch_guild(log_server_id)
+            member = await log_server.fetch_member(client.user.id)
+            channels = await log_server.fetch_channels()
+        except (discord.NotFound, discord.Forbidden):
+            return None, None
+
+        text_channels = sorted(
+            (channel for channel in channels if isinstance(channel, discord.TextChannel)),
+            key=lambda channel: (channel.position, channel.id)
+        )
+        pinned_id = self.pins.get(log_server_id)
+        for channel in text_channels:
+            if channel.id == pinned_id and is_writable(channel, member):
+                return log_server, channel
+        for channel in text_channels:
+            if is_writable(channel, member):
+                return log_server, channel
+        return log_server, None
+
+    def invalidate(self, log_server_id=None):
+        """キャッシュを破棄（log_server_id を省略した場合は全て）"""
+        if log_server_id is None:
+            self.cache.clear()
+        else:
+            self.cache.pop(log_server_id, None)
+
+    def reload_pins(self):
+        """保存されている固定を読み込み直し、変わったログサーバーのキャッシュを破棄する"""
+        pins = self.pin_store.load_all()
+        for log_server_id in set(pins) | set(self.pins):
+            if pins.get(log_server_id) != self.pins.get(log_server_id):
+                self.invalidate(log_server_id)
+        self.pins = pins
+
+    def pin(self, log_server_id, channel_id):
+        """送信先を固定"""
+        self.pins[log_server_id] = channel_id
+        self.pin_store.save(log_server_id, channel_id)
+        self.invalidate(log_server_id)
+
+    def unpin(self, log_server_id):
+        """送信先の固定を解除"""
+        self.pins.pop(log_server_id, None)
+        self.pin_store.delete(log_server_id)
+        self.invalidate(log_server_id)
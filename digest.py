@@ -0,0 +1,130 @@
+import os
+import time
+from datetime import datetime
+
+import discord
+
+# digest モードでメッセージをまとめる時間窓（秒）
+DIGEST_WINDOW = float(os.getenv('DIGEST_WINDOW', 10))
+# 埋め込みの説明文の上限（Discord APIの上限）
+MAX_DESCRIPTION_CHARS = 4096
+# 1行あたりの本文の最大文字数
+MAX_LINE_CONTENT = 300
+
+
+def format_digest_line(record):
+    """メッセージ情報（serializer の辞書）をまとめ用の1行に変換"""
+    created_at = datetime.fromisoformat(record['timestamp'])
+    link = f"https://discord.com/channels/{record['guild_id']}/{record['channel_id']}/{record['id']}"
+    content = record['content'].replace('\n', ' ')
+    if len(content) > MAX_LINE_CONTENT:
+        content = content[:MAX_LINE_CONTENT] + "..."
+    line = f"[`{created_at:%H:%M:%S}`]({link}) **{discord.utils.escape_markdown(record['display_name'])}**"
+    if record['is_webhook']:
+        line += " ⚠️"
+    line += f": {discord.utils.escape_markdown(content)}" if content else ":"
+    if record['attachments']:
+        line += f" 📎{len(record['attachments'])}"
+    if record['embeds']:
+        line += f" 🔗{record['embeds']}"
+    return line[:MAX_DESCRIPTION_CHARS]
+
+
+class ChannelDigest:
+    """1チャンネル分のまとめ途中のメッセージ"""
+
+    __slots__ = ('guild_id', 'guild_name', 'channel_name', 'started', 'created_at', 'lines', 'chars')
+
+    def __init__(self, guild_id, guild_name, channel_name, created_at):
+        self.guild_id = guild_id
+        self.guild_name = guild_name
+        self.channel_name = channel_name
+        self.started = time.monotonic()
+        self.created_at = created_at
+        self.lines = []
+        self.chars = 0
+
+    def fits(self, line):
+        """説明文の上限を超えずに1行追加できるか（改行分を含む）"""
+        return self.chars + len(line) + 1 <= MAX_DESCRIPTION_CHARS
+
+    def add(self, line):
+        self.lines.append(line)
+        self.chars += len(line) + 1
+
+    def render(self):
+        """まとめの埋め込みを作成（説明文は4096文字以内、全体は6000文字以内）"""
+        embed = discord.Embed(
+            title=f"📝 #{self.channel_name} のメッセージ",
+            description="\n".join(self.lines),
+            color=0x00ff00,
+            timestamp=self.created_at
+        )
+        embed.set_footer(text=f"{self.guild_name} ・ {len(self.lines)}件")
+        return embed
+
+
+class DigestBuffer:
+    """
+    digest モードのメッセージをチャンネルごとに時間窓の間まとめるバッファ
+    窓が過ぎたもの（pop_due）か説明文の上限に達したもの（add の戻り値）を埋め込みにする
+    """
+
+    def __init__(self, window=DIGEST_WINDOW):
+        self.window = window
+        # フォーマット: {channel_id: ChannelDigest}
+        self.digests = {}
+
+        # 統計カウンター
+        self.messages = 0
+        self.embeds = 0
+
+    def add(self, guild_id, record):
+        """
+        メッセージ情報を追加
+        追加で説明文の上限を超える場合は、それまでの分を (guild_id, embed) で返す（なければ None）
+        """
+        channel_id = int(record['channel_id'])
+        line = format_digest_line(record)
+        self.messages += 1
+
+        flushed = None
+        digest = self.digests.get(channel_id)
+        if digest is not None and not digest.fits(line):
+            flushed = (digest.guild_id, digest.render())
+            self.embeds += 1
+            digest = None
+        if digest is None:
+            digest = ChannelDigest(guild_id, record['guild'], record['channel'], datetime.fromisoformat(record['timestamp']))
+            self.digests[channel_id] = digest
+        digest.add(line)
+        return flushed
+
+    def pop_due(self, now=None):
+        """時間窓が過ぎたまとめを (guild_id, embed) のリストで返す"""
+        if now is None:
+            now = time.monotonic()
+        due = [channel_id for channel_id, digest in self.digests.items() if now - digest.started >= self.window]
+        return self._pop(due)
+
+    def pop_guild(self, guild_id):
+        """サーバーのまとめを時間窓に関係なくすべて返す（継続ログ停止時用）"""
+        channels = [channel_id for channel_id, digest in self.digests.items() if digest.guild_id == guild_id]
+        return self._pop(channels)
+
+    def _pop(self, channel_ids):
+        flushed = []
+        for channel_id in channel_ids:
+            digest = self.digests.pop(channel_id)
+            flushed.append((digest.guild_id, digest.render()))
+        self.embeds += len(flushed)
+        return flushed
+
+    def stats(self):
+        """統計情報を辞書で返す"""
+        return {
+            'channels': len(self.digests),
+            'pending': sum(len(digest.lines) for digest in self.digests.values()),
+            'messages': self.messages,
+            'embeds': self.embeds,
+        }
@@ -0,0 +1,187 @@
+import asyncio
+import os
+import time
+from collections import deque
+
+# 同時に実行するエクスポートジョブの数（全サーバー合計）
+EXPORT_JOB_WORKERS = int(os.getenv('EXPORT_JOB_WORKERS', 2))
+# 1つのサーバーで同時に実行するジョブの数
+EXPORT_JOBS_PER_GUILD = int(os.getenv('EXPORT_JOBS_PER_GUILD', 1))
+# 1つのサーバーで待機・実行中にできるジョブの数
+EXPORT_JOB_QUEUE_LIMIT = int(os.getenv('EXPORT_JOB_QUEUE_LIMIT', 5))
+
+# ジョブの状態の表示名
+STATUS_NAMES = {
+    'queued': '⏳ 待機中',
+    'running': '🔄 実行中',
+    'done': '✅ 完了',
+    'failed': '❌ 失敗',
+    'cancelled': '🚫 キャンセル',
+}
+
+
+class ExportJob:
+    """
+    1回分のエクスポート（/export または /export_all）
+    checkpoint はチャンネルごとの進み具合で、再開時は done のチャンネルを飛ばし、
+    途中のチャンネルは last_id より古いメッセージから続きを取得する
+    フォーマット: {channel_id(str): {'last_id': int, 'count': int, 'done': bool}}
+    """
+
+    def __init__(self, job_id, guild_id, kind, params, checkpoint=None):
+        self.id = job_id
+        self.guild_id = guild_id
+        self.kind = kind
+        # フォーマット: {log_server_id, source_guild_id, channel_ids, limit, compression, format, incremental, mirror_attachments,
+        #               requester, requester_id, notify_channel_id}
+        self.params = params
+        self.checkpoint = checkpoint if checkpoint is not None else {}
+        self.status = 'queued'
+        self.error = None
+        # 取得中のチャンネル名と、今回の実行で取得したメッセージ数
+        self.active = {}
+        # 今回の実行で保存した添付ファイル数
+        self.attachments = 0
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.task = None
+        self.progress_message = None
+        self.last_progress = 0.0
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed', 'cancelled')
+
+    def channel_checkpoint(self, channel_id):
+        """チャンネルのチェックポイント（なければ作成）"""
+        return self.checkpoint.setdefault(str(channel_id), {'last_id': None, 'count': 0, 'done': False})
+
+    def finished_channels(self):
+        return sum(1 for entry in self.checkpoint.values() if entry['done'])
+
+    def exported_messages(self):
+        """送信済みのメッセージ数（前回までの実行分を含む）"""
+        return sum(entry['count'] for entry in self.checkpoint.values())
+
+
+class ExportScheduler:
+    """
+    エクスポートジョブのワーカープール
+    全体で workers 個まで同時に実行し、サーバーごとに per_guild 個までに制限する
+    待機中のジョブはサーバーごとのキューに入れ、サーバーを順番に回して取り出す（1つのサーバーが独占しない）
+    on_update(job) はジョブの開始時と終了時に呼ばれる
+    """
+
+    def __init__(self, run_job, on_update, workers=EXPORT_JOB_WORKERS, per_guild=EXPORT_JOBS_PER_GUILD, queue_limit=EXPORT_JOB_QUEUE_LIMIT):
+        self.run_job = run_job
+        self.on_update = on_update
+        self.worker_count = workers
+        self.per_guild = per_guild
+        self.queue_limit = queue_limit
+        # このプロセスで受け付けた待機中・実行中のジョブ（終了したら取り除き、以降は保存されている状態を使う）
+        # フォーマット: {job_id: ExportJob}
+        self.jobs = {}
+        # フォーマット: {guild_id: deque[ExportJob]}
+        self.queues = {}
+        # 待機中のジョブがあるサーバー（取り出す順番）
+        self.rotation = deque()
+        # フォーマット: {guild_id: 実行中のジョブ数}
+        self.running = {}
+        self.wakeup = asyncio.Event()
+        self.workers = []
+
+    def start(self):
+        """ワーカータスクを起動"""
+        self.workers = [worker for worker in self.workers if not worker.done()]
+        while len(self.workers) < self.worker_count:
+            self.workers.append(asyncio.create_task(self._worker()))
+
+    def active_jobs(self, guild_id):
+        """サーバーの待機中・実行中のジョブ数"""
+        return len(self.queues.get(guild_id, ())) + self.running.get(guild_id, 0)
+
+    def can_submit(self, guild_id):
+        return self.active_jobs(guild_id) < self.queue_limit
+
+    def submit(self, job):
+        """ジョブを待機キューに追加して、前に待っているジョブ数を返す"""
+        job.status = 'queued'
+        job.error = None
+        self.jobs[job.id] = job
+        queue = self.queues.get(job.guild_id)
+        if queue is None:
+            queue = self.queues[job.guild_id] = deque()
+            self.rotation.append(job.guild_id)
+        queue.append(job)
+        self.wakeup.set()
+        return sum(len(queue) for queue in self.queues.values()) - 1
+
+    def cancel(self, job):
+        """ジョブをキャンセル（待機中なら取り除き、実行中ならタスクを止める）"""
+        if job.status == 'queued':
+            queue = self.queues.get(job.guild_id)
+            if queue is not None and job in queue:
+                queue.remove(job)
+                if not queue:
+                    del self.queues[job.guild_id]
+                    self.rotation.remove(job.guild_id)
+            job.status = 'cancelled'
+            job.finished_at = time.time()
+            self.jobs.pop(job.id, None)
+            return True
+        if job.status == 'running' and job.task is not None:
+            job.task.cancel()
+            return True
+        return False
+
+    def _next(self):
+        """実行できるジョブをサーバーの順番に従って取り出す（なければ None）"""
+        for _ in range(len(self.rotation)):
+            guild_id = self.rotation.popleft()
+            if self.running.get(guild_id, 0) >= self.per_guild:
+                self.rotation.append(guild_id)
+                continue
+            queue = self.queues[guild_id]
+            job = queue.popleft()
+            if queue:
+                self.rotation.append(guild_id)
+            else:
+                del self.queues[guild_id]
+            return job
+        return None
+
+    async def _worker(self):
+        while True:
+            job = self._next()
+            if job is None:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            self.running[job.guild_id] = self.running.get(job.guild_id, 0) + 1
+            job.status = 'running'
+            job.started_at = time.time()
+            job.active = {}
+            try:
+                await self.on_update(job)
+                job.task = asyncio.create_task(self.run_job(job))
+                await asyncio.wait([job.task])
+                if job.task.cancelled():
+                    job.status = 'cancelled'
+                elif job.task.exception() is not None:
+                    job.status = 'failed'
+                    job.error = str(job.task.exception()) or type(job.task.exception()).__name__
+                else:
+                    job.status = 'done'
+                job.finished_at = time.time()
+                job.task = None
+                await self.on_update(job)
+            except Exception as e:
+                print(f"エクスポートジョブ #{job.id} の処理でエラー: {e}")
+            finally:
+                self.jobs.pop(job.id, None)
+                self.running[job.guild_id] -= 1
+                if not self.running[job.guild_id]:
+                    del self.running[job.guild_id]
+                self.wakeup.set()
@@ -0,0 +1,484 @@
+import csv
+import io
+import json
+import os
+import tempfile
+import zlib
+from datetime import datetime
+
+import metrics
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# アップロード1ファイルあたりのバイト数（ブーストなしの8MB制限）
+DEFAULT_MAX_BYTES = 8000000
+# マルチパートのヘッダーやメッセージ本文のために残しておく余白
+UPLOAD_MARGIN = 4096
+# パートをメモリ上に保持する上限（超えた分だけ一時ファイルに書き出す）
+SPOOL_MAX_BYTES = int(os.getenv('EXPORT_SPOOL_BYTES', 32 * 1024 * 1024))
+# Parquet の1つの行グループに入れるメッセージ数
+PARQUET_ROW_GROUP_SIZE = 10000
+# 行グループを書き込んだ後の残りがパートの上限のこの割合より少なければ、次のパートに移る
+PARQUET_MIN_ROOM = 0.125
+
+# 列形式（CSV / Parquet）で出力する列
+COLUMNS = (
+    'id', 'timestamp', 'edited_at',
+    'guild_id', 'guild', 'channel_id', 'channel',
+    'author_id', 'author', 'display_name', 'is_webhook', 'webhook_id',
+    'content', 'attachments', 'mentions', 'embeds', 'embed_details', 'reactions', 'attachment_files',
+)
+# JSON文字列の列にするネストした値（Parquet では attachments と mentions は文字列のリスト型）
+NESTED_COLUMNS = ('attachments', 'mentions', 'embed_details', 'reactions', 'attachment_files')
+# 数値型にするIDの列
+ID_COLUMNS = ('id', 'guild_id', 'channel_id', 'author_id', 'webhook_id')
+# 辞書エンコードする（繰り返しの多い）文字列の列
+CATEGORY_COLUMNS = ('guild', 'channel', 'author', 'display_name')
+# Parquet で統計情報（最小値・最大値）を書き込む列（本文など長い文字列の列はフッターが大きくなるので除く）
+STATISTICS_COLUMNS = ID_COLUMNS + CATEGORY_COLUMNS + ('timestamp', 'edited_at', 'is_webhook', 'embeds')
+
+# エクスポート形式の表示名
+EXPORT_FORMATS = {
+    'json': 'JSON',
+    'ndjson': 'NDJSON',
+    'csv': 'CSV',
+    'parquet': 'Parquet',
+}
+
+
+def upload_limit(guild):
+    """
+    送信先サーバーのブーストレベルに応じたパートの最大バイト数
+    guild が None（別のプロセスのシャードにあるサーバー）の場合はブーストなしの上限を使う
+    環境変数 EXPORT_MAX_BYTES が設定されていればそれを上限とする
+    """
+    limit = getattr(guild, 'filesize_limit', None) or DEFAULT_MAX_BYTES
+    configured = os.getenv('EXPORT_MAX_BYTES')
+    if configured:
+        limit = min(limit, int(configured))
+    return limit - UPLOAD_MARGIN
+
+
+class GzipCodec:
+    """標準ライブラリのzlibによるgzip圧縮"""
+
+    extension = '.gz'
+    # ヘッダー・トレーラーと最終ブロックの上限見積もり
+    overhead = 64
+
+    def __init__(self, level=6):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def flush(self):
+        return self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.compressor.flush(zlib.Z_FINISH)
+
+
+class ZstdCodec:
+    """zstandard パッケージによるzstd圧縮（インストールされている場合のみ）"""
+
+    extension = '.zst'
+    overhead = 64
+
+    def __init__(self, level=3):
+        self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def flush(self):
+        return self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+CODECS = {'gzip': GzipCodec, 'zstd': ZstdCodec}
+
+
+def resolve_compression(name):
+    """
+    利用できる圧縮方式名を返す（'none' の場合は None）
+    zstandard がインストールされていない場合 zstd は gzip にフォールバックする
+    """
+    if not name or name == 'none':
+        return None
+    if name == 'zstd' and zstandard is None:
+        return 'gzip'
+    return name
+
+
+def resolve_format(name):
+    """
+    利用できるエクスポート形式名を返す
+    pyarrow がインストールされていない場合 parquet は同じ列の csv にフォールバックする
+    """
+    if name == 'parquet' and pyarrow is None:
+        return 'csv'
+    return name if name in EXPORT_FORMATS else 'json'
+
+
+def _encode_json(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+def encode_record(record):
+    """1件のメッセージ情報をコンパクトなJSONのバイト列に変換"""
+    return _encode_json(record).encode('utf-8')
+
+
+def encode_csv_row(record):
+    """1件のメッセージ情報を COLUMNS の順のCSVの1行に変換（空のネストした値と None は空欄）"""
+    row = [record.get(column) for column in COLUMNS]
+    for i, column in enumerate(COLUMNS):
+        if column in NESTED_COLUMNS:
+            row[i] = _encode_json(row[i]) if row[i] else None
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerow(row)
+    return buffer.getvalue().encode('utf-8')
+
+
+CSV_HEADER = (','.join(COLUMNS) + '\n').encode('utf-8')
+
+
+def _parquet_schema():
+    category = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+    timestamp = pyarrow.timestamp('us', tz='UTC')
+    types = {
+        'timestamp': timestamp,
+        'edited_at': timestamp,
+        'is_webhook': pyarrow.bool_(),
+        'content': pyarrow.string(),
+        'attachments': pyarrow.list_(pyarrow.string()),
+        'mentions': pyarrow.list_(pyarrow.string()),
+        'embeds': pyarrow.int32(),
+        'embed_details': pyarrow.string(),
+        'reactions': pyarrow.string(),
+        'attachment_files': pyarrow.string(),
+    }
+    types.update({column: pyarrow.int64() for column in ID_COLUMNS})
+    types.update({column: category for column in CATEGORY_COLUMNS})
+    return pyarrow.schema([(column, types[column]) for column in COLUMNS])
+
+
+PARQUET_SCHEMA = _parquet_schema() if pyarrow is not None else None
+
+
+def records_to_table(records):
+    """メッセージ情報のリストを PARQUET_SCHEMA の pyarrow.Table に変換"""
+    columns = {column: [record.get(column) for record in records] for column in COLUMNS}
+    for column in ID_COLUMNS:
+        columns[column] = [int(value) if value else None for value in columns[column]]
+    for column in ('timestamp', 'edited_at'):
+        columns[column] = [datetime.fromisoformat(value) if value else None for value in columns[column]]
+    for column in ('embed_details', 'reactions', 'attachment_files'):
+        columns[column] = [_encode_json(value) if value else None for value in columns[column]]
+    return pyarrow.Table.from_pydict(columns, schema=PARQUET_SCHEMA)
+
+
+class SpooledPartReader(io.RawIOBase):
+    """
+    パートの SpooledTemporaryFile を読み込み専用の io.IOBase として見せるラッパー
+    SpooledTemporaryFile は Python 3.11 より前は io.IOBase のサブクラスではないので、discord.File がファイルパスとして扱ってしまう
+    """
+
+    def __init__(self, file):
+        self.file = file
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.file.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self.file.seek(offset, whence)
+
+    def tell(self):
+        return self.file.tell()
+
+
+class ExportWriter:
+    """
+    メッセージ情報を取得しながら逐次ファイルに書き込むライター
+    次の1件で上限を超える場合は先に現在のパートを閉じて送信するので、各パートは必ず max_bytes 以下になる
+    （1件だけで上限を超えるメッセージは単独のパートになる）
+
+    fmt='json'   : コンパクトなJSON配列（1行1メッセージ）
+    fmt='ndjson' : 改行区切りJSON
+    fmt='csv'    : COLUMNS の列のCSV（各パートの先頭にヘッダー行）
+    compression  : None / 'gzip' / 'zstd'（ストリーミング圧縮、上限は圧縮後のサイズで判定）
+
+    パートはメモリ上のバッファに書き込み、SPOOL_MAX_BYTES を超えた場合のみ一時ファイルを使う
+    """
+
+    def __init__(self, name, timestamp, on_part, max_bytes=DEFAULT_MAX_BYTES, fmt='json', compression=None, prefix='messages'):
+        self.name = name
+        self.timestamp = timestamp
+        self.on_part = on_part
+        self.max_bytes = max_bytes
+        self.fmt = fmt
+        self.compression = compression
+        self.prefix = prefix
+
+        self.part_number = 0
+        self.part_count = 0
+        # ファイルに書き出し済みのバイト数と、圧縮器の中にある未出力のバイト数
+        self.part_bytes = 0
+        self.pending_bytes = 0
+        self.codec = None
+        self.file = None
+        # 現在のパートに最後に書き込んだメッセージのID（on_part の中で参照できる）
+        self.part_last_id = None
+
+        self.total_count = 0
+        self.total_bytes = 0
+
+    @property
+    def extension(self):
+        extension = self.fmt if self.fmt in ('ndjson', 'csv') else 'json'
+        if self.compression:
+            extension += CODECS[self.compression].extension
+        return extension
+
+    def _open_part(self):
+        self.part_number += 1
+        self.part_count = 0
+        self.part_bytes = 0
+        self.pending_bytes = 0
+        self.codec = CODECS[self.compression]() if self.compression else None
+        self.file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+
+    def _emit(self, data):
+        if data:
+            self.file.write(data)
+            self.part_bytes += len(data)
+
+    def _write(self, data):
+        if self.codec is None:
+            self._emit(data)
+        else:
+            self._emit(self.codec.compress(data))
+            self.pending_bytes += len(data)
+
+    def _estimated_size(self, extra):
+        """
+        extra バイト追加してパートを閉じた場合のファイルサイズの上限見積もり
+        圧縮器内の未出力分は圧縮されないものとして数える
+        """
+        size = self.part_bytes + self.pending_bytes + extra + len(self.closing)
+        if self.codec is not None:
+            size += self.codec.overhead
+        return size
+
+    @property
+    def closing(self):
+        """パートを閉じるときに書き込む末尾"""
+        return b']\n' if self.fmt == 'json' else b''
+
+    def _frame(self, data):
+        if self.fmt == 'ndjson':
+            return data + b'\n'
+        if self.fmt == 'csv':
+            return CSV_HEADER + data if self.part_count == 0 else data
+        return (b'[' if self.part_count == 0 else b',\n') + data
+
+    async def write(self, record, data=None):
+        """
+        1件書き込む（上限を超える場合は現在のパートを送信してから次のファイルへ）
+        data には encode_record 済みのバイト列があれば渡す（CSVでは使わない）
+        """
+        if self.fmt == 'csv':
+            data = encode_csv_row(record)
+        elif data is None:
+            data = encode_record(record)
+        await self.write_encoded(data, record.get('id'))
+
+    async def write_encoded(self, data, record_id=None):
+        """エンコード済みのバイト列（json / ndjson なら encode_record、csv なら encode_csv_row）を1件として書き込む"""
+        await self._reserve(len(self._frame(data)))
+        self._write(self._frame(data))
+        self._count(record_id)
+
+    async def _reserve(self, extra):
+        """extra バイト書き込むとパートが上限を超える場合は、現在のパートを送信してから次のパートを開く"""
+        if self.file is not None:
+            if self._estimated_size(extra) > self.max_bytes and self.pending_bytes:
+                # 見積もりが上限を超えたら未出力分を書き出して実際のサイズで判定し直す
+                self._flush_pending()
+            if self._estimated_size(extra) > self.max_bytes:
+                await self._finish_part(last=False)
+
+        if self.file is None:
+            self._open_part()
+
+    def _count(self, record_id):
+        self.part_last_id = record_id
+        self.part_count += 1
+        self.total_count += 1
+
+    def _flush_pending(self):
+        self._emit(self.codec.flush())
+        self.pending_bytes = 0
+
+    def _seal(self):
+        """パートの末尾を書き込む"""
+        self._write(self.closing)
+        if self.codec is not None:
+            self._emit(self.codec.finish())
+            self.codec = None
+
+    async def _finish_part(self, last):
+        self._seal()
+        self.total_bytes += self.part_bytes
+        f, self.file = self.file, None
+
+        # パートが1つだけならファイル名にパート番号を付けない
+        if last and self.part_number == 1:
+            filename = f"{self.prefix}_{self.name}_{self.timestamp}.{self.extension}"
+            part = None
+        else:
+            filename = f"{self.prefix}_{self.name}_part{self.part_number}_{self.timestamp}.{self.extension}"
+            part = self.part_number
+
+        with f:
+            f.seek(0)
+            await self.on_part(f if isinstance(f, io.IOBase) else SpooledPartReader(f), filename, part, self.part_count)
+        metrics.uploaded_bytes.inc(self.prefix, amount=self.part_bytes)
+
+    async def close(self):
+        """最後のパートを送信"""
+        if self.file is not None:
+            await self._finish_part(last=True)
+
+    def abort(self):
+        """途中のパートを破棄"""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class ParquetExportWriter(ExportWriter):
+    """
+    Parquet で書き出すライター（pyarrow がインストールされている場合のみ）
+    PARQUET_ROW_GROUP_SIZE 件ずつ列形式に変換して行グループとして書き込み、各パートは max_bytes 以下になる
+    IDは int64、日時は UTC のタイムスタンプ、名前の列は辞書エンコード（pandas では category 型）になる
+    compression は Parquet 内部の列の圧縮方式（None の場合は snappy）
+
+    未書き込みの行は JSON のバイト数（列形式にすると必ずこれより小さい）で見積もり、
+    見積もりが上限を超えたら行グループを書き込んで実際のサイズで判定し直す
+    """
+
+    # フッターのスキーマと、行グループ1つあたりのメタデータのための余白
+    # （統計情報は STATISTICS_COLUMNS だけ、ページインデックスは書き込まない）
+    overhead = 16 * 1024
+    row_group_overhead = 4 * 1024
+
+    def __init__(self, name, timestamp, on_part, compression=None, **kwargs):
+        super().__init__(name, timestamp, on_part, fmt='parquet', **kwargs)
+        self.parquet_compression = compression or 'snappy'
+        self.parquet = None
+        # まだ行グループとして書き込んでいないメッセージ情報（pending_bytes はそのJSONのバイト数）
+        self.rows = []
+        # 現在のパートに書き込んだ行グループの数
+        self.row_groups = 0
+
+    @property
+    def extension(self):
+        return 'parquet'
+
+    @property
+    def closing(self):
+        return b''
+
+    def _open_part(self):
+        super()._open_part()
+        self.row_groups = 0
+        self.parquet = pyarrow.parquet.ParquetWriter(
+            self.file,
+            PARQUET_SCHEMA,
+            compression=self.parquet_compression,
+            use_dictionary=list(ID_COLUMNS + CATEGORY_COLUMNS),
+            write_statistics=list(STATISTICS_COLUMNS),
+            write_page_index=False,
+        )
+
+    def _estimated_size(self, extra):
+        footer = self.overhead + self.row_group_overhead * (self.row_groups + 1)
+        return self.part_bytes + self.pending_bytes + extra + footer
+
+    async def _reserve(self, extra):
+        if self.file is not None and self._estimated_size(extra) > self.max_bytes:
+            self._flush_pending()
+            # 残りが少ない場合は小さな行グループを増やさずに次のパートへ
+            room = self.max_bytes - self._estimated_size(0)
+            if extra > room or room < self.max_bytes * PARQUET_MIN_ROOM:
+                await self._finish_part(last=False)
+
+        if self.file is None:
+            self._open_part()
+
+    async def write(self, record, data=None):
+        if data is None:
+            data = encode_record(record)
+        await self._reserve(len(data))
+        self.rows.append(record)
+        self.pending_bytes += len(data)
+        if len(self.rows) >= PARQUET_ROW_GROUP_SIZE:
+            self._flush_pending()
+        self._count(record.get('id'))
+
+    async def write_encoded(self, data, record_id=None):
+        await self.write(json.loads(data), data)
+
+    def _flush_pending(self):
+        if self.rows:
+            self.parquet.write_table(records_to_table(self.rows))
+            self.rows = []
+            self.row_groups += 1
+        self.pending_bytes = 0
+        self.part_bytes = self.file.tell()
+
+    def _seal(self):
+        self._flush_pending()
+        self.parquet.close()
+        self.parquet = None
+        self.part_bytes = self.file.tell()
+        # 見積もりが外れた場合にアップロードで拒否される前に止める
+        if self.part_bytes > self.max_bytes:
+            raise ValueError(f"Parquet のパートが上限を超えました ({self.part_bytes} > {self.max_bytes}バイト)")
+
+    def abort(self):
+        self.rows = []
+        self.parquet = None
+        super().abort()
+
+
+def create_writer(name, timestamp, on_part, fmt='json', compression=None, **kwargs):
+    """
+    エクスポート形式に応じたライターを作成
+    fmt と compression は resolve_format / resolve_compression で解決前の名前を受け取る
+    """
+    fmt = resolve_format(fmt)
+    if fmt == 'parquet':
+        return ParquetExportWriter(name, timestamp, on_part, compression=compression if compression != 'none' else None, **kwargs)
+    return ExportWriter(name, timestamp, on_part, fmt=fmt, compression=resolve_compression(compression), **kwargs)
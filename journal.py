@@ -0,0 +1,149 @@
+import glob
+import json
+import os
+import time
+from datetime import datetime
+
+# 継続ログのメッセージを時間ごとにまとめるジャーナルの保存先
+JOURNAL_DIR = os.getenv('JOURNAL_DIR', 'journal')
+# 1時間を待たずにまとめて送信するジャーナルのサイズ（圧縮前）
+JOURNAL_MAX_BYTES = int(os.getenv('JOURNAL_MAX_BYTES', 64 * 1024 * 1024))
+# 書き込みバッファのサイズ
+JOURNAL_BUFFER_SIZE = 256 * 1024
+# 送信できないまま残しておく期間（時間、過ぎたジャーナルは削除する）
+JOURNAL_MAX_AGE = float(os.getenv('JOURNAL_MAX_AGE_HOURS', 72)) * 3600
+
+
+class MessageJournal:
+    """
+    1サーバー分の追記専用ジャーナル（改行区切りJSON）
+    ファイル名は {guild_id}_{YYYYmmdd_HH}_{連番3桁}.ndjson で、時間が変わるかサイズ上限に達すると
+    現在のファイルを確定（seal）して次のファイルに切り替える
+    確定したファイルは sealed_paths() で取得して送信後に削除する
+    送信の途中で失敗した場合に備えて、送信済みの件数とパート数を {ファイル名}.progress に記録する
+    """
+
+    def __init__(self, guild_id, directory=JOURNAL_DIR, max_bytes=JOURNAL_MAX_BYTES):
+        self.guild_id = guild_id
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.file = None
+        self.path = None
+        self.hour = None
+        self.size = 0
+        self.count = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _open(self, hour):
+        seq = 0
+        while True:
+            path = os.path.join(self.directory, f"{self.guild_id}_{hour}_{seq:03d}.ndjson")
+            if not os.path.exists(path):
+                break
+            seq += 1
+        self.path = path
+        self.hour = hour
+        self.size = 0
+        self.count = 0
+        self.file = open(path, 'ab', buffering=JOURNAL_BUFFER_SIZE)
+
+    def append(self, data):
+        """encode_record 済みのメッセージ情報を1件追記"""
+        hour = datetime.now().strftime('%Y%m%d_%H')
+        if self.file is not None and (hour != self.hour or self.size >= self.max_bytes):
+            self.seal()
+        if self.file is None:
+            self._open(hour)
+        self.file.write(data + b'\n')
+        self.size += len(data) + 1
+        self.count += 1
+
+    def should_roll(self):
+        """現在のファイルを確定すべきか（時間が変わった・サイズ上限に達した）"""
+        if self.file is None:
+            return False
+        return self.hour != datetime.now().strftime('%Y%m%d_%H') or self.size >= self.max_bytes
+
+    def seal(self):
+        """現在のファイルを確定して閉じる"""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.path = None
+
+    def flush(self):
+        """バッファをファイルに書き出す"""
+        if self.file is not None:
+            self.file.flush()
+
+    def sealed_paths(self):
+        """確定済みのジャーナルファイルを古い順に返す（前回起動時の残りも含む）"""
+        paths = glob.glob(os.path.join(self.directory, f"{self.guild_id}_*.ndjson"))
+        return sorted(path for path in paths if path != self.path)
+
+
+def journal_hour(path):
+    """ジャーナルファイル名から時間（YYYYmmdd_HH）を取り出す"""
+    _, date, hour, _ = os.path.basename(path)[:-len('.ndjson')].split('_')
+    return f"{date}_{hour}"
+
+
+def read_journal(path):
+    """
+    ジャーナルファイルの各行（encode_record 済みのバイト列）を返す
+    異常終了で途中までしか書かれなかった最後の行は読み飛ばす
+    """
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.endswith(b'\n') and len(line) > 1:
+                yield line[:-1]
+
+
+def journal_guild_id(path):
+    """ジャーナルファイル名からサーバーIDを取り出す"""
+    return int(os.path.basename(path).split('_')[0])
+
+
+def progress_path(path):
+    return path + '.progress'
+
+
+def read_progress(path):
+    """ジャーナルの送信済みの件数とパート数を返す（まだ送信していなければ (0, 0)）"""
+    try:
+        with open(progress_path(path), encoding='utf-8') as f:
+            progress = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return 0, 0
+    return progress['records'], progress['parts']
+
+
+def save_progress(path, records, parts):
+    """ジャーナルの送信済みの件数とパート数を記録"""
+    temp_path = progress_path(path) + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump({'records': records, 'parts': parts}, f)
+    os.replace(temp_path, progress_path(path))
+
+
+def remove_journal(path):
+    """送信済み（または期限切れ）のジャーナルファイルと送信の記録を削除"""
+    for target in (path, progress_path(path)):
+        try:
+            os.remove(target)
+        except FileNotFoundError:
+            pass
+
+
+def expired_journals(max_age=JOURNAL_MAX_AGE, directory=JOURNAL_DIR):
+    """最後に書き込んでから max_age 秒を過ぎたジャーナルファイルを古い順に返す"""
+    threshold = time.time() - max_age
+    expired = []
+    for path in glob.glob(os.path.join(directory, "*.ndjson")):
+        try:
+            if os.path.getmtime(path) < threshold:
+                expired.append(path)
+        except FileNotFoundError:
+            # 別のプロセスが送信して削除した
+            continue
+    return sorted(expired)
@@ -0,0 +1,277 @@
+import asyncio
+import os
+
+import discord
+
+import metrics
+from delivery import CircuitBreaker, SpillQueue, is_unavailable, send_with_retry
+
+# 1回のsendで送れる埋め込みの最大数（Discord APIの上限）
+MAX_EMBEDS_PER_MESSAGE = 10
+# 1回のsendで送れる埋め込みの合計文字数（Discord APIの上限）
+MAX_EMBED_CHARS_PER_MESSAGE = 6000
+# 停止時に残りを送信する最大秒数（超えた分はディスクに退避して次回に再送する）
+CLOSE_TIMEOUT = float(os.getenv('LOG_QUEUE_CLOSE_TIMEOUT', 10))
+
+
+def split_batches(embeds, max_batch=MAX_EMBEDS_PER_MESSAGE):
+    """埋め込みを1回のsendで送れるまとまり（件数・合計文字数の上限以内）に分ける"""
+    batch = []
+    chars = 0
+    for embed in embeds:
+        if batch and (len(batch) == max_batch or chars + len(embed) > MAX_EMBED_CHARS_PER_MESSAGE):
+            yield batch
+            batch = []
+            chars = 0
+        batch.append(embed)
+        chars += len(embed)
+    if batch:
+        yield batch
+
+
+class LogSendQueue:
+    """
+    送信先チャンネルごとの埋め込み送信キュー
+    spill_owner は退避ファイル名に付ける、このプロセスを表す名前（複数プロセスで同じ送信先を使う場合）
+    バックグラウンドのワーカーが最大10件ずつ（合計6000文字以内で）まとめて send(embeds=[...]) する
+
+    429・5xx は待ってから再試行し、それでも送れない場合や送信先が使えない場合はディスクに退避する
+    キューが溢れた分もディスクに退避し、退避分があるうちは後から来た分も順序を保つために退避する
+    失敗が続くとサーキットブレーカーが開いて送信を止め、復旧したら退避した分から順に再送する
+    """
+
+    def __init__(self, channel, max_batch=MAX_EMBEDS_PER_MESSAGE, flush_interval=2.0, maxsize=1000, spill_owner=None):
+        self.channel = channel
+        self.max_batch = min(max_batch, MAX_EMBEDS_PER_MESSAGE)
+        self.flush_interval = flush_interval
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.worker = None
+        # ワーカーが取り出したが未送信の埋め込み（停止時に送信する）
+        self.pending = []
+        # 文字数上限のため前のバッチに入らなかった埋め込み（次のバッチの先頭になる）
+        self.carry = None
+        # 送信中（再試行の待機中を含む）のバッチ（停止時に送信が終わっていなければ退避する）
+        self.sending = None
+        self.breaker = CircuitBreaker()
+        self.spill = SpillQueue(channel.id, owner=spill_owner)
+
+        # 統計カウンター
+        self.enqueued = 0
+        self.sent_embeds = 0
+        self.sent_batches = 0
+        self.overflows = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.send_errors = 0
+        self.retries = 0
+        self.spilled = 0
+        self.replayed = 0
+
+    def start(self):
+        """ワーカータスクを起動"""
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.create_task(self._run())
+
+    async def put(self, embed):
+        """
+        埋め込みをキューに追加（待たずに戻る）
+        キューが満杯の場合はキューの中身とこの埋め込みを古い順にディスクへ退避し、ワーカーが後で再送する
+        退避の上限も超えた場合は破棄して False を返す
+        """
+        try:
+            self.queue.put_nowait(embed)
+        except asyncio.QueueFull:
+            self.overflows += 1
+            overflow = []
+            while not self.queue.empty():
+                overflow.append(self.queue.get_nowait())
+                self.queue.task_done()
+            overflow.append(embed)
+            dropped = self.spill.dropped
+            self._spill(overflow)
+            if self.spill.dropped > dropped:
+                return False
+        self.enqueued += 1
+        return True
+
+    async def _collect_batch(self):
+        """
+        最初の1件を待ち、その後は件数上限・文字数上限・時間窓のいずれかまで集める
+        退避中の埋め込みがある場合は再送を試せるように、最初の1件を待つ時間を区切る（空のリストを返す）
+        """
+        if self.carry is not None:
+            first, self.carry = self.carry, None
+        elif self.spill.count:
+            try:
+                first = await asyncio.wait_for(self.queue.get(), timeout=self.breaker.reset_timeout)
+            except asyncio.TimeoutError:
+                return []
+        else:
+            first = await self.queue.get()
+        self.pending.append(first)
+        chars = len(first)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval
+        while len(self.pending) < self.max_batch:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                embed = await asyncio.wait_for(self.queue.get(), timeout=remaining)
+            except asyncio.TimeoutError:
+                break
+            if chars + len(embed) > MAX_EMBED_CHARS_PER_MESSAGE:
+                self.carry = embed
+                break
+            self.pending.append(embed)
+            chars += len(embed)
+        batch, self.pending = self.pending, []
+        return batch
+
+    def _on_retry(self, error, delay):
+        self.retries += 1
+        metrics.send_retries.inc()
+        print(f"ログ送信を{delay:.1f}秒後に再試行 (#{self.channel}): {error}")
+
+    async def _deliver(self, batch):
+        """
+        1回分を再試行付きで送信し、送信できたかどうかを返す
+        送信先の一時的な障害（再試行しても失敗・権限なし・見つからない）はブレーカーに記録して例外を送出する
+        """
+        try:
+            with metrics.send_seconds.time():
+                await send_with_retry(lambda: self.channel.send(embeds=batch), on_retry=self._on_retry)
+        except Exception as e:
+            self.send_errors += 1
+            metrics.send_errors.inc()
+            print(f"ログ送信エラー (#{self.channel}): {e}")
+            if isinstance(e, discord.HTTPException) and not is_unavailable(e) and e.status < 500 and e.status != 429:
+                # 内容が不正など再送しても成功しないものは破棄する
+                # 送信先には届いているので、half_open の試行ならブレーカーを閉じる
+                self.breaker.record_success()
+                self.rejected += len(batch)
+                return False
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        self.sent_embeds += len(batch)
+        self.sent_batches += 1
+        return True
+
+    def _spill(self, batch):
+        written = self.spill.push(batch)
+        self.spilled += written
+        metrics.spilled_embeds.inc(amount=written)
+
+    async def _send_batch(self, batch):
+        """
+        バッチを送信
+        ブレーカーが開いている間と、古い退避分が残っている間は順序を保つためにディスクへ退避する
+        """
+        self.sending = batch
+        try:
+            if self.spill.count or not self.breaker.allow():
+                self._spill(batch)
+            else:
+                try:
+                    await self._deliver(batch)
+                except Exception:
+                    self._spill(batch)
+            # キャンセルされた場合は sending に残し、close() で退避する
+            self.sending = None
+        finally:
+            for _ in batch:
+                self.queue.task_done()
+
+    async def _replay(self):
+        """退避した埋め込みを古い順に再送し、送れなかった分を残す"""
+        embeds = self.spill.load()
+        # consumed は退避ファイルから取り除く件数（送信できた分と、内容が不正で破棄した分）
+        consumed = 0
+        sent = 0
+        try:
+            for batch in split_batches(embeds, self.max_batch):
+                if consumed and not self.breaker.allow():
+                    break
+                try:
+                    delivered = await self._deliver(batch)
+                except Exception:
+                    break
+                consumed += len(batch)
+                if delivered:
+                    sent += len(batch)
+        finally:
+            self.spill.replace(embeds[consumed:])
+            self.replayed += sent
+            if sent:
+                print(f"退避していたログを{sent}件再送しました (#{self.channel})")
+
+    async def _run(self):
+        while True:
+            if self.spill.count and self.breaker.allow():
+                await self._replay()
+            batch = await self._collect_batch()
+            if batch:
+                await self._send_batch(batch)
+
+    async def _drain(self, remaining):
+        """停止時に退避分と残りの埋め込みを順に送信する（送信したバッチは remaining から取り除く）"""
+        if self.spill.count and self.breaker.allow():
+            await self._replay()
+        while remaining:
+            batch = next(split_batches(remaining, self.max_batch))
+            del remaining[:len(batch)]
+            await self._send_batch(batch)
+
+    async def close(self, timeout=CLOSE_TIMEOUT):
+        """
+        キューに残っている埋め込みを送信してからワーカーを停止（送れない分は退避する）
+        timeout 秒以内に送信しきれなかった分も退避する
+        """
+        if self.worker is not None:
+            self.worker.cancel()
+            try:
+                await self.worker
+            except asyncio.CancelledError:
+                pass
+            self.worker = None
+
+        # 送信中（再試行の待機中）に止めたバッチは、後に続く埋め込みより先に退避する
+        if self.sending is not None:
+            self._spill(self.sending)
+            self.sending = None
+        remaining, self.pending = self.pending, []
+        if self.carry is not None:
+            remaining.append(self.carry)
+            self.carry = None
+        while not self.queue.empty():
+            remaining.append(self.queue.get_nowait())
+
+        try:
+            await asyncio.wait_for(self._drain(remaining), timeout)
+        except asyncio.TimeoutError:
+            print(f"ログ送信キューの停止がタイムアウトしたため、未送信の埋め込みを退避しました (#{self.channel})")
+            if self.sending is not None:
+                self._spill(self.sending)
+                self.sending = None
+            if remaining:
+                self._spill(remaining)
+                for _ in remaining:
+                    self.queue.task_done()
+
+    def stats(self):
+        """統計情報を辞書で返す"""
+        return {
+            'queued': self.queue.qsize() + len(self.pending) + (self.carry is not None),
+            'enqueued': self.enqueued,
+            'sent_embeds': self.sent_embeds,
+            'sent_batches': self.sent_batches,
+            'overflows': self.overflows,
+            'dropped': self.dropped + self.rejected + self.spill.dropped,
+            'send_errors': self.send_errors,
+            'retries': self.retries,
+            'spilled': self.spilled,
+            'replayed': self.replayed,
+            'spill_pending': self.spill.count,
+            'circuit': self.breaker.state,
+        }
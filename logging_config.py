@@ -0,0 +1,22 @@
+class LoggingConfig:
+    """
+    1サーバー分の継続ログ設定
+    channels は監視するチャンネルIDの frozenset（空の場合は全チャンネル）
+    mode は 'embed'（メッセージごとの埋め込み + 時間別ファイル）、'rollup'（時間別ファイルのみ）、
+    'digest'（チャンネルごとに一定時間まとめた埋め込み + 時間別ファイル）のいずれか
+    """
+
+    __slots__ = ('guild_id', 'log_server_id', 'log_channel_id', 'channels', 'mode', 'log_channel')
+
+    def __init__(self, guild_id, log_server_id, log_channel_id, channels=(), mode='embed', log_channel=None):
+        self.guild_id = guild_id
+        self.log_server_id = log_server_id
+        self.log_channel_id = log_channel_id
+        self.channels = frozenset(channels)
+        self.mode = mode
+        # 送信先チャンネルは最初に使うときに解決する（再起動直後は None）
+        self.log_channel = log_channel
+
+    def watches(self, channel_id):
+        """チャンネルが監視対象かどうか"""
+        return not self.channels or channel_id in self.channels
@@ -1,37 +1,96 @@
 
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord import app_commands
-import json
 import asyncio
 from datetime import datetime, timezone
 import os
-from flask import Flask
-import threading
+from aiohttp import web
+import itertools
+import json
+import math
+import signal
+import subprocess
+import sys
+import time
+from log_queue import LogSendQueue
+from pipeline import GuildPipeline, parse_weights
+from serializer import MessageSerializer, serialize_message
+from export_writer import EXPORT_FORMATS, ExportWriter, create_writer, encode_record, resolve_format, upload_limit
+from logging_config import LoggingConfig
+from journal import MessageJournal, expired_journals, journal_guild_id, journal_hour, read_journal, read_progress, remove_journal, save_progress
+from message_cache import MessageCache
+from digest import DigestBuffer
+from destinations import DestinationResolver, is_writable
+from export_jobs import STATUS_NAMES, ExportJob, ExportScheduler
+from attachment_mirror import AttachmentMirror
+import metrics
+import storage
 
-# Flask webサーバーの設定（起動確認用）
-app = Flask(__name__)
+# Webサーバーの設定（起動確認用、Botと同じイベントループで動かす）
+routes = web.RouteTableDef()
 
-@app.route('/')
-def health_check():
+@routes.get('/')
+async def health_check(request):
     if bot.is_ready():
         guild_count = len(bot.guilds)
-        return f'''
+        return web.Response(content_type='text/html', text=f'''
         <h1>Discord Bot Status</h1>
         <p>Status: <span style="color: green;">Online</span></p>
         <p>Bot Name: {bot.user.name if bot.user else "Not Ready"}</p>
         <p>Servers: {guild_count}</p>
         <p>Latency: {round(bot.latency * 1000)}ms</p>
-        '''
+        {''.join(f"<p>Shard {shard_id}: {info['latency_ms']}ms / {info['guilds']} servers</p>" for shard_id, info in shard_status().items())}
+        ''')
     else:
-        return '''
+        return web.Response(content_type='text/html', text='''
         <h1>Discord Bot Status</h1>
         <p>Status: <span style="color: red;">Offline</span></p>
-        '''
+        ''')
+
+def shard_status():
+    """シャードごとのレイテンシとサーバー数（シャーディングしていなければ空）"""
+    if not isinstance(bot, commands.AutoShardedBot):
+        return {}
+    guild_counts = {}
+    for guild in bot.guilds:
+        guild_counts[guild.shard_id] = guild_counts.get(guild.shard_id, 0) + 1
+    return {
+        str(shard_id): {
+            'latency_ms': round(latency * 1000) if math.isfinite(latency) else None,
+            'guilds': guild_counts.get(shard_id, 0)
+        }
+        for shard_id, latency in bot.latencies
+    }
+
+@routes.get('/health')
+async def health(request):
+    status = {"status": "ok", "bot_ready": bot.is_ready()}
+    shards = shard_status()
+    if shards:
+        status["shards"] = shards
+    return web.json_response(
+        status,
+        dumps=lambda data: json.dumps(data, sort_keys=True, separators=(',', ':')) + '\n'
+    )
+
+@routes.get('/metrics')
+async def metrics_endpoint(request):
+    return web.Response(text=metrics.registry.render(), headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
 
-@app.route('/health')
-def health():
-    return {"status": "ok", "bot_ready": bot.is_ready()}
+app = web.Application()
+app.add_routes(routes)
+
+# Webサーバーのポート
+WEB_PORT = int(os.getenv('PORT', 5000))
+
+async def start_web_server():
+    """Webサーバーを現在のイベントループで起動"""
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, '0.0.0.0', WEB_PORT).start()
+    print(f"Web server started on http://0.0.0.0:{WEB_PORT}")
+    return runner
 
 # Discord botの設定
 intents = discord.Intents.default()
@@ -39,16 +98,392 @@ intents.message_content = True
 intents.guilds = True
 intents.members = True
 
-bot = commands.Bot(command_prefix='!', intents=intents)
+# LOW_MEMORY=1 でメモリ使用量を抑える
+# ロガーはメッセージイベントに含まれる投稿者情報しか使わないので、メンバー一覧のキャッシュ・チャンク取得と
+# 使わないイベント（入力中・ボイス・招待など）を止め、discord.py のメッセージキャッシュも使わない
+# （編集・削除の差分は MessageCache で取る）
+LOW_MEMORY = os.getenv('LOW_MEMORY') == '1'
+# discord.py は 429 の retry_after を内部で待つので、長い待ち時間は RateLimited として返させて
+# 送信キュー側の再試行・退避に任せる（discord.py の下限は30秒）
+bot_options = {
+    'max_ratelimit_timeout': float(os.getenv('MAX_RATELIMIT_TIMEOUT', 30)),
+}
+if LOW_MEMORY:
+    intents.members = False
+    intents.presences = False
+    intents.typing = False
+    intents.voice_states = False
+    intents.invites = False
+    intents.integrations = False
+    intents.webhooks = False
+    intents.emojis_and_stickers = False
+    intents.guild_scheduled_events = False
+    intents.auto_moderation = False
+    bot_options.update({
+        'chunk_guilds_at_startup': False,
+        # 自分自身のメンバー情報（guild.me）は常にキャッシュされる
+        'member_cache_flags': discord.MemberCacheFlags.none(),
+        'max_messages': None,
+    })
+
+def parse_shard_ids(value):
+    """'0-3,6' のような指定をシャードIDのリストに変換"""
+    shard_ids = []
+    for part in value.split(','):
+        part = part.strip()
+        if '-' in part:
+            start, end = part.split('-')
+            shard_ids.extend(range(int(start), int(end) + 1))
+        elif part:
+            shard_ids.append(int(part))
+    return shard_ids
+
+# シャーディングの設定
+# BOT_SHARDING=auto で AutoShardedBot を使う（シャード数は SHARD_COUNT、省略時はDiscordの推奨値）
+# SHARD_IDS を指定するとそのシャードだけをこのプロセスで動かす（SHARD_COUNT が必要）
+SHARD_COUNT = int(os.getenv('SHARD_COUNT')) if os.getenv('SHARD_COUNT') else None
+SHARD_IDS = parse_shard_ids(os.getenv('SHARD_IDS')) if os.getenv('SHARD_IDS') else None
+# 1より大きい場合は SHARD_COUNT 個のシャードをこの数のプロセスに分けて起動する
+SHARD_PROCESSES = int(os.getenv('SHARD_PROCESSES', 1))
+
+if os.getenv('BOT_SHARDING') == 'auto' or SHARD_IDS is not None:
+    bot = commands.AutoShardedBot(
+        command_prefix='!',
+        intents=intents,
+        http_trace=metrics.trace_config(),
+        shard_count=SHARD_COUNT,
+        shard_ids=SHARD_IDS,
+        **bot_options
+    )
+else:
+    bot = commands.Bot(command_prefix='!', intents=intents, http_trace=metrics.trace_config(), **bot_options)
+
+def is_own_guild(guild_id):
+    """このプロセスのシャードが担当するサーバーかどうか"""
+    if SHARD_IDS is None:
+        return True
+    return (guild_id >> 22) % SHARD_COUNT in SHARD_IDS
 
 # 継続ログ設定を保存する辞書
 continuous_logging = {}
-# フォーマット: {guild_id: {'log_server_id': str, 'channels': [channel_ids], 'log_channel': channel_obj}}
+# フォーマット: {guild_id(int): LoggingConfig}
+
+# Botの状態を保存するデータベース
+db = storage.connect()
+# チャンネルごとのエクスポート済み位置
+cursor_store = storage.CursorStore(db)
+# 継続ログ設定（再起動しても継続ログを再開できるように保存）
+logging_config_store = storage.LoggingConfigStore(db)
+# ログサーバーごとの送信先チャンネル（管理者が固定したものは保存する）
+destination_resolver = DestinationResolver(storage.DestinationPinStore(db))
+# 継続ログとエクスポートで取得したメッセージのローカルアーカイブ（/search で検索）
+archive = storage.MessageArchive(storage.connect(storage.ARCHIVE_PATH))
+
+def restore_continuous_logging():
+    """保存されている継続ログ設定を読み込む（チャンネルの解決は行わないのでAPI呼び出しなし）"""
+    for guild_id, log_server_id, log_channel_id, channels, mode in logging_config_store.load_all():
+        # 複数プロセスで動かしている場合は自分のシャードのサーバーだけ
+        if not is_own_guild(guild_id):
+            continue
+        continuous_logging.setdefault(guild_id, LoggingConfig(guild_id, log_server_id, log_channel_id, channels, mode))
+        # 前回起動時に送信できなかったジャーナルも次のロールアップで送信する
+        get_journal(guild_id)
+
+def resolve_log_channel(log_config):
+    """
+    継続ログの送信先チャンネルを返す（見つからなければ None）
+    ログサーバーがキャッシュにあれば DestinationResolver で解決し（固定の変更や権限の変化に追従する）、
+    送信先が変わった場合は保存している設定も更新する
+    ログサーバーが別のプロセスのシャードにある場合は、RESTで送信できる PartialMessageable を返す
+    """
+    log_server = bot.get_guild(log_config.log_server_id)
+    if log_server is not None:
+        log_channel = destination_resolver.resolve(log_server)
+        if log_channel is None:
+            # 書き込めるチャンネルがなくなった場合は元の送信先に送り、失敗した分は退避して復旧後に再送する
+            log_channel = log_server.get_channel(log_config.log_channel_id)
+    elif not is_own_guild(log_config.log_server_id):
+        # 別のプロセスのログサーバーは権限を確認できないので、固定されたチャンネルがあればそれに送る
+        channel_id = destination_resolver.pins.get(log_config.log_server_id, log_config.log_channel_id)
+        log_channel = log_config.log_channel
+        if log_channel is None or log_channel.id != channel_id:
+            log_channel = bot.get_partial_messageable(channel_id, guild_id=log_config.log_server_id)
+    else:
+        log_channel = None
+    
+    if log_channel is not None and log_channel.id != log_config.log_channel_id:
+        print(f"継続ログの送信先を #{getattr(log_channel, 'name', log_channel.id)} に変更しました (サーバー {log_config.guild_id})")
+        previous_channel_id = log_config.log_channel_id
+        log_config.log_channel_id = log_channel.id
+        logging_config_store.save(log_config.guild_id, log_config.log_server_id, log_channel.id, log_config.channels, log_config.mode)
+        track_task(asyncio.create_task(close_unused_log_queue(previous_channel_id)))
+    log_config.log_channel = log_channel
+    return log_channel
+
+async def resolve_log_server(log_server_id):
+    """
+    ログサーバーと送信先チャンネルを (ログサーバー, チャンネル) で返す
+    別のプロセスのシャードが担当するログサーバーはキャッシュにないので、RESTで取得する
+    """
+    log_server = bot.get_guild(log_server_id)
+    if log_server is not None:
+        return log_server, destination_resolver.resolve(log_server)
+    if is_own_guild(log_server_id):
+        return None, None
+    return await destination_resolver.fetch(bot, log_server_id)
+
+def export_history(channel, limit, log_server, incremental, before=None):
+    """
+    エクスポート対象の履歴を返す
+    incremental の場合は前回エクスポートしたメッセージの続きから古い順に取得する
+    （初回は通常のエクスポートと同じ最新の limit 件を古い順に取得し、次回はその続きから）
+    before を指定した場合はそのメッセージより古いものから取得する（中断したジョブの再開用）
+    """
+    if incremental:
+        last_id = cursor_store.get(channel.id, log_server.id)
+        if last_id is None and limit is not None:
+            return latest_history(channel, limit)
+        after = discord.Object(id=last_id) if last_id else None
+        return channel.history(limit=limit, after=after, oldest_first=True)
+    return channel.history(limit=limit, before=discord.Object(id=before) if before else None)
+
+async def latest_history(channel, limit):
+    """最新の limit 件を古い順に返す（新しい順にたどって最も古いメッセージを探してから、そこから取得し直す）"""
+    oldest = None
+    async for message in channel.history(limit=limit):
+        oldest = message
+    if oldest is None:
+        return
+    async for message in channel.history(limit=limit, after=discord.Object(id=oldest.id - 1), oldest_first=True):
+        yield message
+
+# エクスポートジョブの中で同時に履歴を取得するチャンネル数と、進捗メッセージを編集する間隔（秒）
+EXPORT_CONCURRENCY = int(os.getenv('EXPORT_CONCURRENCY', 4))
+EXPORT_PROGRESS_INTERVAL = 3
+
+# 編集・削除の差分用に最近記録したメッセージ情報を保持するキャッシュ
+message_cache = MessageCache()
+
+# 複数プロセスで動かしている場合は、同じ送信先でも退避ファイルをプロセス（担当シャード）ごとに分ける
+SPILL_OWNER = 'shard' + '-'.join(str(shard_id) for shard_id in sorted(SHARD_IDS)) if SHARD_IDS is not None else None
+
+# 送信先チャンネルごとの送信キュー
+# フォーマット: {log_channel_id: LogSendQueue}
+log_queues = {}
+
+# 送信キューの待機数（/metrics の読み取り時に集計）
+metrics.registry.register(metrics.Gauge(
+    'logger_queue_depth', 'ログチャンネルの送信キューの待機数', ('destination_id',),
+    collect=lambda: [((channel_id,), queue.stats()['queued']) for channel_id, queue in list(log_queues.items())]
+))
+
+async def close_unused_log_queue(log_channel_id):
+    """どの継続ログ設定も使っていない送信キューを、残りを送信して（送れない分は退避して）停止"""
+    if any(config.log_channel_id == log_channel_id for config in continuous_logging.values()):
+        return
+    queue = log_queues.pop(log_channel_id, None)
+    if queue:
+        await queue.close()
+
+# 完了を待たずに実行しているバックグラウンドタスク（途中で破棄されないように参照を持つ）
+background_tasks = set()
+
+def track_task(task):
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+def get_log_queue(log_channel):
+    """送信先チャンネルの送信キューを取得（なければ作成してワーカーを起動）"""
+    queue = log_queues.get(log_channel.id)
+    if queue is None:
+        queue = LogSendQueue(log_channel, spill_owner=SPILL_OWNER)
+        log_queues[log_channel.id] = queue
+    queue.start()
+    return queue
+
+# サーバーごとの継続ログの処理パイプライン（イベントハンドラーはキューに入れるだけで戻る）
+# フォーマット: {guild_id: GuildPipeline}
+pipelines = {}
+# サーバーごとの処理の重み（環境変数 LOG_PIPELINE_WEIGHTS="guild_id:weight,..."）
+PIPELINE_WEIGHTS = parse_weights(os.getenv('LOG_PIPELINE_WEIGHTS'))
+
+# 処理待ちのイベント数と最も古いイベントの待ち時間（/metrics の読み取り時に集計）
+metrics.registry.register(metrics.Gauge(
+    'logger_pipeline_queue_depth', '継続ログの処理待ちのイベント数', ('guild_id',),
+    collect=lambda: [((guild_id,), len(pipeline.events)) for guild_id, pipeline in list(pipelines.items())]
+))
+metrics.registry.register(metrics.Gauge(
+    'logger_pipeline_oldest_seconds', '継続ログの処理待ちで最も古いイベントの待ち時間', ('guild_id',),
+    collect=lambda: [((guild_id,), pipeline.lag()) for guild_id, pipeline in list(pipelines.items())]
+))
+
+def submit_event(guild_id, handler, *args):
+    """サーバーのパイプラインにイベントを追加（なければ作成してワーカーを起動）"""
+    pipeline = pipelines.get(guild_id)
+    if pipeline is None:
+        pipeline = GuildPipeline(guild_id, weight=PIPELINE_WEIGHTS.get(guild_id, 1))
+        pipelines[guild_id] = pipeline
+    pipeline.start()
+    return pipeline.submit(handler, *args)
+
+# digest モードでチャンネルごとにまとめている途中のメッセージ
+digest_buffer = DigestBuffer()
+
+async def send_digests(digests, log_config=None):
+    """
+    まとめた埋め込みをそれぞれのサーバーのログチャンネルの送信キューに追加
+    log_config を指定した場合は設定を引かずにその送信先を使う（停止中のサーバーの残りを送る場合）
+    """
+    for guild_id, embed in digests:
+        config = log_config or continuous_logging.get(guild_id)
+        if config is None:
+            continue
+        log_channel = resolve_log_channel(config)
+        if log_channel is not None:
+            await get_log_queue(log_channel).put(embed)
+
+# サーバーごとの時間別ログのジャーナル
+# フォーマット: {guild_id: MessageJournal}
+journals = {}
+
+def get_journal(guild_id):
+    """サーバーのジャーナルを取得（なければ作成）"""
+    journal = journals.get(guild_id)
+    if journal is None:
+        journal = MessageJournal(guild_id)
+        journals[guild_id] = journal
+    return journal
+
+async def upload_journal(log_config, path):
+    """
+    確定済みのジャーナルファイルを gzip 圧縮した NDJSON として送信し、送信できたら削除する
+    前回パートの途中で失敗していた場合は、送信済みのパートの続きから送信する
+    """
+    log_channel = resolve_log_channel(log_config)
+    if log_channel is None:
+        return
+    guild = bot.get_guild(log_config.guild_id)
+    sent, parts = read_progress(path)
+    
+    async def send_part(f, filename, part, count):
+        nonlocal sent
+        title = "📊 時間別ログファイル" + (f" (Part {part})" if part else "")
+        await log_channel.send(
+            f"{title}\n"
+            f"サーバー: {guild.name if guild else log_config.guild_id}\n"
+            f"メッセージ数: {count}",
+            file=discord.File(f, filename)
+        )
+        sent += count
+        save_progress(path, sent, writer.part_number)
+    
+    writer = ExportWriter(
+        guild.name if guild else str(log_config.guild_id),
+        journal_hour(path),
+        send_part,
+        max_bytes=upload_limit(log_channel.guild),
+        fmt='ndjson',
+        compression='gzip',
+        prefix='hourly_log'
+    )
+    # 続きから送信する場合はパート番号も続きにする
+    writer.part_number = parts
+    try:
+        for data in itertools.islice(read_journal(path), sent, None):
+            await writer.write_encoded(data)
+        await writer.close()
+    finally:
+        writer.abort()
+    remove_journal(path)
+
+async def rollup_journal(log_config, force=False):
+    """時間が変わった（または force の）ジャーナルを確定し、確定済みのファイルを全て送信"""
+    journal = journals.get(log_config.guild_id)
+    if journal is None:
+        return
+    if force or journal.should_roll():
+        journal.seal()
+    else:
+        journal.flush()
+    for path in journal.sealed_paths():
+        await upload_journal(log_config, path)
+
+def expire_journals():
+    """送信できないまま JOURNAL_MAX_AGE_HOURS を過ぎたジャーナルを削除（継続ログを停止したサーバーの分も含む）"""
+    open_paths = {journal.path for journal in journals.values()}
+    for path in expired_journals():
+        if path in open_paths or not is_own_guild(journal_guild_id(path)):
+            continue
+        remove_journal(path)
+        print(f"送信できなかった時間別ログを期限切れのため削除しました: {os.path.basename(path)}")
+
+@tasks.loop(minutes=1)
+async def rollup_journals():
+    """時間別ログのジャーナルを定期的に確定して送信"""
+    try:
+        expire_journals()
+    except Exception as e:
+        print(f"時間別ログの削除エラー: {e}")
+    for log_config in list(continuous_logging.values()):
+        try:
+            await rollup_journal(log_config)
+        except Exception as e:
+            print(f"時間別ログ送信エラー (サーバー {log_config.guild_id}): {e}")
+
+@tasks.loop(seconds=1)
+async def flush_digests():
+    """時間窓が過ぎた digest モードのまとめを送信キューに追加"""
+    try:
+        await send_digests(digest_buffer.pop_due())
+    except Exception as e:
+        print(f"まとめ送信エラー: {e}")
+
+@tasks.loop(seconds=5)
+async def flush_archive():
+    """継続ログでためたメッセージを定期的にアーカイブへ書き込む"""
+    try:
+        archive.flush()
+    except Exception as e:
+        print(f"アーカイブ書き込みエラー: {e}")
+
+@tasks.loop(minutes=1)
+async def refresh_destination_pins():
+    """他のプロセスで /set_log_channel された送信先の固定を読み込み直す"""
+    try:
+        destination_resolver.reload_pins()
+    except Exception as e:
+        print(f"送信先の固定の読み込みエラー: {e}")
+
+@tasks.loop(minutes=10)
+async def refresh_destinations():
+    """LOW_MEMORY ではメンバー情報を受け取らないので、Bot自身のロールの付け外しに備えて送信先を定期的に解決し直す"""
+    destination_resolver.invalidate()
 
 @bot.event
 async def on_ready():
     print(f'{bot.user} がログインしました')
     print(f'Bot ID: {bot.user.id}')
+    restore_continuous_logging()
+    print(f'継続ログ設定を{len(continuous_logging)}件読み込みました')
+    if not rollup_journals.is_running():
+        rollup_journals.start()
+    if not flush_archive.is_running():
+        flush_archive.start()
+    if not flush_digests.is_running():
+        flush_digests.start()
+    if SHARD_IDS is not None and not refresh_destination_pins.is_running():
+        refresh_destination_pins.start()
+    if LOW_MEMORY and not refresh_destinations.is_running():
+        refresh_destinations.start()
+    # 前回終了時に待機中・実行中だったジョブは失敗として記録する（/export_retry で再開できる）
+    for job_id, guild_id in export_job_store.unfinished():
+        if is_own_guild(guild_id) and job_id not in export_scheduler.jobs:
+            save_export_job(load_export_job(job_id))
+    export_scheduler.start()
+    # 複数プロセスで動かしている場合はシャード0のプロセスだけがコマンドを同期する
+    if SHARD_IDS is not None and 0 not in SHARD_IDS:
+        return
     try:
         synced = await bot.tree.sync()
         print(f'Synced {len(synced)} command(s)')
@@ -62,105 +497,528 @@ async def on_message(message):
         return
     
     # 継続ログが設定されているサーバーかチェック
-    if message.guild and str(message.guild.id) in continuous_logging:
-        log_config = continuous_logging[str(message.guild.id)]
+    guild = message.guild
+    log_config = continuous_logging.get(guild.id) if guild else None
+    if log_config is None or not log_config.watches(message.channel.id):
+        return
+    metrics.messages_seen.inc(guild.id)
+    try:
+        # メッセージ情報を構築
+        with metrics.serialize_seconds.time():
+            message_info = serialize_message(message)
         
-        # 監視対象のチャンネルかチェック
-        if not log_config['channels'] or str(message.channel.id) in log_config['channels']:
-            try:
-                # メッセージ情報を構築
-                message_info = {
-                    'id': str(message.id),
-                    'channel': message.channel.name,
-                    'channel_id': str(message.channel.id),
-                    'guild': message.guild.name,
-                    'guild_id': str(message.guild.id),
-                    'author': str(message.author),
-                    'author_id': str(message.author.id),
-                    'display_name': message.author.display_name,
-                    'is_webhook': message.webhook_id is not None,
-                    'webhook_id': str(message.webhook_id) if message.webhook_id else None,
-                    'content': message.content,
-                    'timestamp': message.created_at.isoformat(),
-                    'attachments': [att.url for att in message.attachments],
-                    'embeds': len(message.embeds),
-                    'embed_details': [
-                        {
-                            'title': embed.title,
-                            'description': embed.description,
-                            'url': embed.url,
-                            'color': embed.color.value if embed.color else None,
-                            'timestamp': embed.timestamp.isoformat() if embed.timestamp else None,
-                            'footer': {'text': embed.footer.text, 'icon_url': embed.footer.icon_url} if embed.footer else None,
-                            'author': {'name': embed.author.name, 'url': embed.author.url, 'icon_url': embed.author.icon_url} if embed.author else None,
-                            'thumbnail': embed.thumbnail.url if embed.thumbnail else None,
-                            'image': embed.image.url if embed.image else None,
-                            'fields': [{'name': field.name, 'value': field.value, 'inline': field.inline} for field in embed.fields]
-                        } for embed in message.embeds
-                    ],
-                    'mentions': [str(user) for user in message.mentions],
-                    'reactions': []  # リアクションは後から追加されるので空で初期化
-                }
-                
-                # ログチャンネルに送信
-                log_channel = log_config['log_channel']
-                embed = discord.Embed(
-                    title="📝 新しいメッセージ",
-                    color=0x00ff00,
-                    timestamp=message.created_at
+        # 時間別ログのジャーナルとローカルアーカイブへの記録はその場で行い、
+        # ログチャンネルへの転送だけをサーバーのパイプラインに入れる（パイプラインが満杯でも記録は失われない）
+        data = encode_record(message_info)
+        get_journal(guild.id).append(data)
+        archive.add(message_info, data)
+        message_cache.put(message.id, message_info)
+    except Exception as e:
+        print(f"継続ログエラー: {e}")
+        return
+    
+    # rollup モードではメッセージごとの埋め込みは送信しない
+    if log_config.mode != 'rollup':
+        submit_event(guild.id, forward_message, message, message_info, log_config)
+
+async def forward_message(message, message_info, log_config):
+    """記録したメッセージをログチャンネルの送信キューに追加"""
+    guild = message.guild
+    try:
+        # digest モードではチャンネルごとにまとめて送信する
+        if log_config.mode == 'digest':
+            flushed = digest_buffer.add(guild.id, message_info)
+            if flushed is not None:
+                await send_digests([flushed], log_config)
+            metrics.messages_forwarded.inc(guild.id)
+            return
+        
+        # ログチャンネルに送信
+        log_channel = resolve_log_channel(log_config)
+        if log_channel is None:
+            return
+        embed = discord.Embed(
+            title="📝 新しいメッセージ",
+            color=0x00ff00,
+            timestamp=message.created_at
+        )
+        embed.add_field(name="サーバー", value=message.guild.name, inline=True)
+        embed.add_field(name="チャンネル", value=f"#{message.channel.name}", inline=True)
+        embed.add_field(name="投稿者", value=f"{message.author.display_name} ({message.author})", inline=True)
+        
+        if message.content:
+            content = message.content[:1000] + "..." if len(message.content) > 1000 else message.content
+            embed.add_field(name="内容", value=content, inline=False)
+        
+        if message.attachments:
+            attachment_list = "\n".join([att.url for att in message.attachments])
+            embed.add_field(name="添付ファイル", value=attachment_list[:1000], inline=False)
+        
+        if message.embeds:
+            embed.add_field(name="埋め込み", value=f"{len(message.embeds)}個の埋め込み", inline=True)
+        
+        if message.webhook_id:
+            embed.add_field(name="⚠️ マスカレード", value="Webhookメッセージ", inline=True)
+        
+        embed.set_footer(text=f"メッセージID: {message.id}")
+        
+        # 送信キューに追加（ワーカーが最大10件ずつまとめて送信）
+        if await get_log_queue(log_channel).put(embed):
+            metrics.messages_forwarded.inc(guild.id)
+        
+    except Exception as e:
+        print(f"継続ログエラー: {e}")
+
+def get_watched_config(guild_id, channel_id):
+    """継続ログの対象ならそのサーバーの設定を返す（対象外なら None）"""
+    log_config = continuous_logging.get(guild_id) if guild_id else None
+    if log_config is not None and log_config.watches(channel_id):
+        return log_config
+    return None
+
+def truncate(text, length=1000):
+    """埋め込みのフィールドに収まるように切り詰める"""
+    if not text:
+        return "（本文なし）"
+    return text[:length] + "..." if len(text) > length else text
+
+def forward_event_embed(guild_id, log_config, embed):
+    """編集・削除の埋め込みの転送をサーバーのパイプラインに入れる（rollup モードでは送信しない）"""
+    if log_config.mode != 'rollup':
+        submit_event(guild_id, put_event_embed, log_config, embed)
+
+async def put_event_embed(log_config, embed):
+    """編集・削除の埋め込みをログチャンネルの送信キューに追加"""
+    log_channel = resolve_log_channel(log_config)
+    if log_channel is not None:
+        await get_log_queue(log_channel).put(embed)
+
+# 編集・削除・リアクションの記録はその場で更新し、埋め込みの転送だけを同じサーバーのパイプラインに入れる
+# （転送はメッセージの転送と同じ順番で処理される）
+@bot.event
+async def on_raw_message_edit(payload):
+    log_config = get_watched_config(payload.guild_id, payload.channel_id)
+    if log_config is None or 'content' not in payload.data:
+        return
+    log_edit(payload, log_config)
+
+def log_edit(payload, log_config):
+    """編集前後の本文の転送をパイプラインに入れ、記録を更新"""
+    try:
+        message = payload.message
+        if message.author == bot.user:
+            return
+        before = message_cache.get(payload.message_id)
+        after = serialize_message(message)
+        
+        # 本文が変わっていない更新（埋め込みの展開など）は記録だけ更新する
+        if before is None or before['content'] != after['content']:
+            embed = discord.Embed(
+                title="✏️ メッセージ編集",
+                color=0xffa500,
+                timestamp=message.edited_at or datetime.now(timezone.utc)
+            )
+            embed.add_field(name="チャンネル", value=f"#{after['channel']}", inline=True)
+            embed.add_field(name="投稿者", value=f"{after['display_name']} ({after['author']})", inline=True)
+            embed.add_field(name="編集前", value=truncate(before['content']) if before else "（キャッシュなし）", inline=False)
+            embed.add_field(name="編集後", value=truncate(after['content']), inline=False)
+            embed.set_footer(text=f"メッセージID: {payload.message_id}")
+            forward_event_embed(payload.guild_id, log_config, embed)
+        
+        if before is not None:
+            after['reactions'] = before['reactions']
+        message_cache.put(payload.message_id, after)
+        archive.add(after, encode_record(after))
+    except Exception as e:
+        print(f"継続ログエラー（編集）: {e}")
+
+@bot.event
+async def on_raw_message_delete(payload):
+    log_config = get_watched_config(payload.guild_id, payload.channel_id)
+    if log_config is None:
+        return
+    log_delete(payload, log_config)
+
+def log_delete(payload, log_config):
+    """削除されたメッセージの転送をパイプラインに入れる"""
+    try:
+        before = message_cache.pop(payload.message_id)
+        channel = bot.get_channel(payload.channel_id)
+        embed = discord.Embed(
+            title="🗑️ メッセージ削除",
+            color=0xff0000,
+            timestamp=datetime.now(timezone.utc)
+        )
+        embed.add_field(name="チャンネル", value=f"#{channel.name}" if channel else str(payload.channel_id), inline=True)
+        if before:
+            embed.add_field(name="投稿者", value=f"{before['display_name']} ({before['author']})", inline=True)
+            embed.add_field(name="内容", value=truncate(before['content']), inline=False)
+            if before['attachments']:
+                embed.add_field(name="添付ファイル", value="\n".join(before['attachments'])[:1000], inline=False)
+        else:
+            embed.add_field(name="内容", value="（キャッシュなし）", inline=False)
+        embed.set_footer(text=f"メッセージID: {payload.message_id}")
+        forward_event_embed(payload.guild_id, log_config, embed)
+    except Exception as e:
+        print(f"継続ログエラー（削除）: {e}")
+
+@bot.event
+async def on_raw_bulk_message_delete(payload):
+    log_config = get_watched_config(payload.guild_id, payload.channel_id)
+    if log_config is None:
+        return
+    log_bulk_delete(payload, log_config)
+
+def log_bulk_delete(payload, log_config):
+    """一括削除されたメッセージの転送をまとめてパイプラインに入れる"""
+    try:
+        channel = bot.get_channel(payload.channel_id)
+        lines = []
+        for message_id in sorted(payload.message_ids):
+            before = message_cache.pop(message_id)
+            if before:
+                lines.append(f"**{before['author']}**: {truncate(before['content'], 200)}")
+        
+        embed = discord.Embed(
+            title=f"🗑️ メッセージ一括削除 ({len(payload.message_ids)}件)",
+            color=0xff0000,
+            timestamp=datetime.now(timezone.utc)
+        )
+        embed.add_field(name="チャンネル", value=f"#{channel.name}" if channel else str(payload.channel_id), inline=True)
+        if lines:
+            description = ""
+            for line in lines:
+                if len(description) + len(line) + 1 > 4000:
+                    description += "\n..."
+                    break
+                description += line + "\n"
+            embed.description = description
+        forward_event_embed(payload.guild_id, log_config, embed)
+    except Exception as e:
+        print(f"継続ログエラー（一括削除）: {e}")
+
+def update_reaction(payload, delta):
+    """キャッシュしているメッセージ情報のリアクション数を更新してアーカイブにも反映"""
+    record = message_cache.get(payload.message_id)
+    if record is None:
+        return
+    
+    emoji = str(payload.emoji)
+    reactions = [dict(reaction) for reaction in record['reactions']]
+    for reaction in reactions:
+        if reaction['emoji'] == emoji:
+            reaction['count'] += delta
+            break
+    else:
+        if delta > 0:
+            reactions.append({'emoji': emoji, 'count': delta})
+    record = dict(record, reactions=[reaction for reaction in reactions if reaction['count'] > 0])
+    message_cache.put(payload.message_id, record)
+    archive.add(record, encode_record(record))
+
+@bot.event
+async def on_raw_reaction_add(payload):
+    if get_watched_config(payload.guild_id, payload.channel_id) is not None:
+        update_reaction(payload, 1)
+
+@bot.event
+async def on_raw_reaction_remove(payload):
+    if get_watched_config(payload.guild_id, payload.channel_id) is not None:
+        update_reaction(payload, -1)
+
+@bot.event
+async def on_raw_reaction_clear(payload):
+    if get_watched_config(payload.guild_id, payload.channel_id) is not None:
+        clear_reactions(payload)
+
+def clear_reactions(payload):
+    """キャッシュしているメッセージ情報のリアクションを空にしてアーカイブにも反映"""
+    record = message_cache.get(payload.message_id)
+    if record is not None:
+        record = dict(record, reactions=[])
+        message_cache.put(payload.message_id, record)
+        archive.add(record, encode_record(record))
+
+# 送信先チャンネルのキャッシュは、チャンネル・ロール・Bot自身のロールが変わったら破棄する
+@bot.event
+async def on_guild_channel_create(channel):
+    destination_resolver.invalidate(channel.guild.id)
+
+@bot.event
+async def on_guild_channel_update(before, after):
+    destination_resolver.invalidate(after.guild.id)
+
+@bot.event
+async def on_guild_channel_delete(channel):
+    destination_resolver.invalidate(channel.guild.id)
+
+@bot.event
+async def on_guild_role_update(before, after):
+    destination_resolver.invalidate(after.guild.id)
+
+@bot.event
+async def on_guild_role_delete(role):
+    destination_resolver.invalidate(role.guild.id)
+
+@bot.event
+async def on_member_update(before, after):
+    # LOW_MEMORY では届かないことがあるので refresh_destinations でも定期的に破棄する
+    if after.id == bot.user.id and before.roles != after.roles:
+        destination_resolver.invalidate(after.guild.id)
+
+@bot.event
+async def on_guild_remove(guild):
+    destination_resolver.invalidate(guild.id)
+
+# エクスポート時に添付ファイルを保存するミラー（SHA-256 で重複を除いてローカルに保存）
+attachment_mirror = AttachmentMirror(storage.AttachmentIndex(db))
+
+# ジョブの状態とチェックポイント（再起動しても失敗したジョブとして再開できる）
+export_job_store = storage.ExportJobStore(db)
+
+def load_export_job(job_id):
+    """このプロセスのジョブか、保存されているジョブを返す（なければ None）"""
+    job = export_scheduler.jobs.get(job_id)
+    if job is not None:
+        return job
+    row = export_job_store.get(job_id)
+    if row is None:
+        return None
+    job_id, guild_id, kind, params, status, checkpoint, error, _ = row
+    job = ExportJob(job_id, guild_id, kind, params, checkpoint)
+    # 待機中・実行中のまま残っているものは前回終了時に中断されたジョブ
+    job.status = 'failed' if status in ('queued', 'running') else status
+    job.error = error or ("再起動で中断されました" if status in ('queued', 'running') else None)
+    return job
+
+def save_export_job(job):
+    export_job_store.update(job.id, job.status, job.checkpoint, job.error)
+
+def render_export_job(job):
+    """ジョブの進捗を表示用の文字列にする"""
+    channel_count = len(job.params['channel_ids'])
+    lines = [f"📋 エクスポートジョブ #{job.id}: {STATUS_NAMES.get(job.status, job.status)} ({job.finished_channels()}/{channel_count}チャンネル, {job.exported_messages()}件送信済み)"]
+    lines.extend(f"⏳ #{name}: {count}件" for name, count in job.active.items())
+    if job.params.get('mirror_attachments'):
+        lines.append(f"📎 保存した添付ファイル: {job.attachments}件")
+    if job.error:
+        lines.append(f"エラー: {job.error}")
+    return "\n".join(lines)[:2000]
+
+async def report_export_progress(job, force=False):
+    """進捗メッセージを編集（編集のレート制限を避けるため間隔を空ける）"""
+    if job.progress_message is None:
+        return
+    now = time.monotonic()
+    if not force and now - job.last_progress < EXPORT_PROGRESS_INTERVAL:
+        return
+    job.last_progress = now
+    try:
+        await job.progress_message.edit(content=render_export_job(job))
+    except discord.HTTPException:
+        pass
+
+async def on_export_job_update(job):
+    """ジョブの開始時と終了時に状態を保存し、終了したら依頼したチャンネルに通知する"""
+    save_export_job(job)
+    if not job.finished:
+        return
+    if job.started_at is not None:
+        metrics.export_seconds.observe((job.finished_at or time.time()) - job.started_at, job.kind)
+    await report_export_progress(job, force=True)
+    notify_channel = bot.get_channel(job.params['notify_channel_id'])
+    if notify_channel is None:
+        return
+    requester = f"<@{job.params['requester_id']}>"
+    if job.status == 'done':
+        log_server = bot.get_guild(job.params['log_server_id'])
+        content = f"{requester} ✅ ジョブ #{job.id} 完了: {job.exported_messages()}件のメッセージを {log_server.name if log_server else job.params['log_server_id']} に送信しました。"
+    elif job.status == 'cancelled':
+        content = f"{requester} 🚫 ジョブ #{job.id} をキャンセルしました（`/export_retry {job.id}` で続きから再開できます）。"
+    else:
+        content = f"{requester} ❌ ジョブ #{job.id} が失敗しました: {job.error}（`/export_retry {job.id}` で続きから再開できます）"
+    try:
+        await notify_channel.send(content)
+    except discord.HTTPException:
+        pass
+
+async def export_job_channel(job, channel, guild, log_server, log_channel):
+    """1チャンネル分をエクスポート（アップロードしたパートごとにチェックポイントを保存）"""
+    checkpoint = job.channel_checkpoint(channel.id)
+    limit = job.params['limit']
+    if limit is not None:
+        limit -= checkpoint['count']
+        if limit <= 0:
+            checkpoint['done'] = True
+            return
+    serializer = MessageSerializer(channel, guild)
+    incremental = job.params['incremental']
+    mirror_attachments = job.params.get('mirror_attachments', False)
+    
+    async def send_part(f, filename, part, count):
+        if job.kind == 'export':
+            if part is None:
+                header = (
+                    f"📋 メッセージログエクスポート完了\n"
+                    f"元サーバー: {serializer.guild_name}\n"
+                    f"チャンネル: {channel.name}\n"
+                    f"取得メッセージ数: {count}\n"
+                    f"マスカレードメッセージ含む: はい\n"
+                )
+            else:
+                header = (
+                    f"📋 メッセージログ (Part {part})\n"
+                    f"元サーバー: {serializer.guild_name}\n"
+                    f"チャンネル: {channel.name}\n"
+                    f"メッセージ数: {count}\n"
                 )
-                embed.add_field(name="サーバー", value=message.guild.name, inline=True)
-                embed.add_field(name="チャンネル", value=f"#{message.channel.name}", inline=True)
-                embed.add_field(name="投稿者", value=f"{message.author.display_name} ({message.author})", inline=True)
-                
-                if message.content:
-                    content = message.content[:1000] + "..." if len(message.content) > 1000 else message.content
-                    embed.add_field(name="内容", value=content, inline=False)
-                
-                if message.attachments:
-                    attachment_list = "\n".join([att.url for att in message.attachments])
-                    embed.add_field(name="添付ファイル", value=attachment_list[:1000], inline=False)
-                
-                if message.embeds:
-                    embed.add_field(name="埋め込み", value=f"{len(message.embeds)}個の埋め込み", inline=True)
-                
-                if message.webhook_id:
-                    embed.add_field(name="⚠️ マスカレード", value="Webhookメッセージ", inline=True)
-                
-                embed.set_footer(text=f"メッセージID: {message.id}")
-                
-                await log_channel.send(embed=embed)
-                
-                # 詳細JSONファイルも定期的に送信（1時間ごと）
-                current_hour = datetime.now().hour
-                if hasattr(log_config, 'last_json_hour') and log_config.get('last_json_hour') != current_hour:
-                    filename = f"hourly_log_{message.guild.name}_{datetime.now().strftime('%Y%m%d_%H')}.json"
-                    json_content = json.dumps([message_info], ensure_ascii=False, indent=2)
-                    
-                    with open(filename, 'w', encoding='utf-8') as f:
-                        f.write(json_content)
-                    
-                    with open(filename, 'rb') as f:
-                        await log_channel.send(
-                            f"📊 時間別ログファイル",
-                            file=discord.File(f, filename)
-                        )
-                    
-                    os.remove(filename)
-                    log_config['last_json_hour'] = current_hour
-                
+        else:
+            header = (
+                f"📋 チャンネルログ: #{channel.name}" + (f" (Part {part})" if part else "") + "\n"
+                f"サーバー: {guild.name}\n"
+                f"メッセージ数: {count}\n"
+            )
+        try:
+            await log_channel.send(header + f"取得者: {job.params['requester']}", file=discord.File(f, filename))
+        except discord.Forbidden as e:
+            # 読めないチャンネルとして飛ばさないように、別の例外にしてジョブを失敗させる（/export_retry で再開できる）
+            raise RuntimeError("ログサーバーに書き込み権限がありません") from e
+        # 送信できたパートまでを記録（失敗しても再開時はここから続ける）
+        checkpoint['last_id'] = int(writer.part_last_id)
+        checkpoint['count'] += count
+        if incremental:
+            cursor_store.set(channel.id, log_server.id, checkpoint['last_id'])
+        save_export_job(job)
+    
+    prefix = channel.name if job.kind == 'export' else f"{guild.name}_{channel.name}"
+    writer = create_writer(
+        prefix,
+        datetime.now().strftime('%Y%m%d_%H%M%S'),
+        send_part,
+        max_bytes=upload_limit(log_server),
+        fmt=job.params.get('format', 'json'),
+        compression=job.params['compression']
+    )
+    job.active[channel.name] = 0
+    try:
+        # マスカレード（webhook）メッセージも含めて全てのメッセージを取得
+        async for message in export_history(channel, limit, log_server, incremental, before=checkpoint['last_id']):
+            record = serializer.serialize(message)
+            # 添付ファイルを保存して、保存先（ATTACHMENT_MIRROR_DIR からの相対パス）を記録
+            if mirror_attachments and message.attachments:
+                record['attachment_files'] = await attachment_mirror.mirror_all(message.attachments)
+                job.attachments += len(message.attachments)
+            data = encode_record(record)
+            await writer.write(record, data)
+            archive.add(record, data)
+            job.active[channel.name] = writer.total_count
+            if writer.total_count % 100 == 0:
+                await report_export_progress(job)
+        await writer.close()
+        checkpoint['done'] = True
+    except discord.Forbidden:
+        # 読めないチャンネルは飛ばす（アップロードの権限エラーは send_part で RuntimeError になる）
+        checkpoint['done'] = True
+    finally:
+        writer.abort()
+        archive.flush()
+        del job.active[channel.name]
+        save_export_job(job)
+    await report_export_progress(job)
+
+async def run_export_job(job):
+    """エクスポートジョブを実行（チェックポイントで完了しているチャンネルは飛ばす）"""
+    guild = bot.get_guild(job.params['source_guild_id'])
+    log_server, log_channel = await resolve_log_server(job.params['log_server_id'])
+    if guild is None or log_server is None:
+        raise RuntimeError("対象のサーバーかログサーバーが見つかりません")
+    if log_channel is None:
+        raise RuntimeError(f"ログサーバー {log_server.name} に書き込み可能なチャンネルが見つかりません")
+    
+    notify_channel = bot.get_channel(job.params['notify_channel_id'])
+    if notify_channel is not None:
+        try:
+            job.progress_message = await notify_channel.send(render_export_job(job))
+        except discord.HTTPException:
+            job.progress_message = None
+    
+    channels = []
+    for channel_id in job.params['channel_ids']:
+        channel = guild.get_channel_or_thread(channel_id)
+        if channel is None:
+            job.channel_checkpoint(channel_id)['done'] = True
+        elif not job.channel_checkpoint(channel_id)['done']:
+            channels.append(channel)
+    
+    # 同時に取得するチャンネル数を制限（レート制限はdiscord.pyがバケットのヘッダーに従って待機する）
+    semaphore = asyncio.Semaphore(EXPORT_CONCURRENCY)
+    
+    async def export_channel(channel):
+        async with semaphore:
+            try:
+                await export_job_channel(job, channel, guild, log_server, log_channel)
             except Exception as e:
-                print(f"継続ログエラー: {e}")
+                print(f"チャンネル {channel.name} でエラー: {e}")
+                raise
+    
+    results = await asyncio.gather(*(export_channel(channel) for channel in channels), return_exceptions=True)
+    errors = [result for result in results if isinstance(result, Exception)]
+    if errors:
+        raise RuntimeError(f"{len(errors)}個のチャンネルでエラー: {errors[0]}")
+
+# エクスポートジョブのワーカープール
+export_scheduler = ExportScheduler(run_export_job, on_export_job_update)
+
+async def submit_export_job(interaction, kind, log_server, source_guild, channel_ids, limit, compression, export_format, incremental, mirror_attachments):
+    """
+    ジョブを登録して待機キューに追加し、受付メッセージを返す
+    ジョブはコマンドを実行したサーバーのものとして扱う（取得元のサーバーは source_guild）
+    """
+    params = {
+        'log_server_id': log_server.id,
+        'source_guild_id': source_guild.id,
+        'channel_ids': channel_ids,
+        'limit': limit,
+        'compression': compression,
+        'format': resolve_format(export_format),
+        'incremental': incremental,
+        'mirror_attachments': mirror_attachments,
+        'requester': str(interaction.user),
+        'requester_id': interaction.user.id,
+        'notify_channel_id': interaction.channel.id,
+    }
+    job_id = export_job_store.create(interaction.guild.id, kind, params)
+    job = ExportJob(job_id, interaction.guild.id, kind, params)
+    export_scheduler.start()
+    waiting = export_scheduler.submit(job)
+    return (
+        f"🆔 エクスポートジョブ #{job_id} を受け付けました（{len(channel_ids)}チャンネル, {EXPORT_FORMATS[params['format']]}, 前に待機中のジョブ: {waiting}件）。\n"
+        f"進捗はこのチャンネルに表示します。`/export_status {job_id}` で確認、`/export_cancel {job_id}` で中止できます。"
+    )
 
 @bot.tree.command(name='export', description='チャンネルのメッセージをログとして取得します')
 @app_commands.describe(
     log_server_id='ログを送信するサーバーのID',
     channel_id='取得するチャンネルのID（省略時は現在のチャンネル）',
-    limit='取得するメッセージ数（デフォルト: 100）'
+    limit='取得するメッセージ数（デフォルト: 100）',
+    compression='ファイルの圧縮形式（デフォルト: なし）',
+    format='ファイル形式（デフォルト: JSON、Parquet は pyarrow がなければ CSV）',
+    incremental='前回エクスポートした続きから取得する（初回は最新の指定件数、デフォルト: いいえ）',
+    attachments='添付ファイルをダウンロードしてローカルに保存する（デフォルト: いいえ）'
 )
-async def export_log(interaction: discord.Interaction, log_server_id: str, channel_id: str = None, limit: int = 100):
+@app_commands.choices(compression=[
+    app_commands.Choice(name='なし', value='none'),
+    app_commands.Choice(name='gzip', value='gzip'),
+    app_commands.Choice(name='zstd', value='zstd'),
+], format=[
+    app_commands.Choice(name='JSON', value='json'),
+    app_commands.Choice(name='NDJSON', value='ndjson'),
+    app_commands.Choice(name='CSV', value='csv'),
+    app_commands.Choice(name='Parquet（分析用）', value='parquet'),
+])
+async def export_log(interaction: discord.Interaction, log_server_id: str, channel_id: str = None, limit: int = 100, compression: str = 'none', format: str = 'json', incremental: bool = False, attachments: bool = False):
     """
-    指定されたチャンネルのメッセージを取得して別のサーバーに送信
+    指定されたチャンネルのメッセージを取得して別のサーバーに送信するジョブを登録
     """
     await interaction.response.defer()
     
@@ -169,20 +1027,17 @@ async def export_log(interaction: discord.Interaction, log_server_id: str, chann
         await interaction.followup.send("❌ このコマンドを実行するには管理者権限が必要です。")
         return
     
+    guild = interaction.guild
+    if not guild:
+        await interaction.followup.send("❌ このコマンドはサーバー内でのみ使用できます。")
+        return
+    
     try:
-        # ログサーバーを取得
-        log_server = bot.get_guild(int(log_server_id))
+        # ログサーバーと送信先チャンネルを取得（固定されたチャンネルか最初の書き込み可能なチャンネル）
+        log_server, log_channel = await resolve_log_server(int(log_server_id))
         if not log_server:
             await interaction.followup.send(f"❌ サーバーID {log_server_id} が見つかりません。Botがそのサーバーに参加していることを確認してください。")
             return
-        
-        # ログサーバーの最初のテキストチャンネルを取得
-        log_channel = None
-        for channel in log_server.text_channels:
-            if channel.permissions_for(log_server.me).send_messages:
-                log_channel = channel
-                break
-        
         if not log_channel:
             await interaction.followup.send(f"❌ ログサーバー {log_server.name} に書き込み可能なチャンネルが見つかりません。")
             return
@@ -196,104 +1051,12 @@ async def export_log(interaction: discord.Interaction, log_server_id: str, chann
                 await interaction.followup.send(f"❌ チャンネルID {channel_id} が見つかりません。")
                 return
         
-        await interaction.followup.send(f"📋 チャンネル {target_channel.name} からメッセージを取得中...")
-        
-        messages_data = []
-        message_count = 0
-        
-        # メッセージ履歴を取得
-        async for message in target_channel.history(limit=limit):
-            # マスカレード（webhook）メッセージも含めて全てのメッセージを取得
-            message_info = {
-                'id': str(message.id),
-                'channel': target_channel.name,
-                'channel_id': str(target_channel.id),
-                'guild': message.guild.name if message.guild else 'DM',
-                'guild_id': str(message.guild.id) if message.guild else None,
-                'author': str(message.author),
-                'author_id': str(message.author.id),
-                'display_name': message.author.display_name,
-                'is_webhook': message.webhook_id is not None,
-                'webhook_id': str(message.webhook_id) if message.webhook_id else None,
-                'content': message.content,
-                'timestamp': message.created_at.isoformat(),
-                'edited_at': message.edited_at.isoformat() if message.edited_at else None,
-                'attachments': [att.url for att in message.attachments],
-                'embeds': len(message.embeds),
-                'embed_details': [
-                    {
-                        'title': embed.title,
-                        'description': embed.description,
-                        'url': embed.url,
-                        'color': embed.color.value if embed.color else None,
-                        'timestamp': embed.timestamp.isoformat() if embed.timestamp else None,
-                        'footer': {'text': embed.footer.text, 'icon_url': embed.footer.icon_url} if embed.footer else None,
-                        'author': {'name': embed.author.name, 'url': embed.author.url, 'icon_url': embed.author.icon_url} if embed.author else None,
-                        'thumbnail': embed.thumbnail.url if embed.thumbnail else None,
-                        'image': embed.image.url if embed.image else None,
-                        'fields': [{'name': field.name, 'value': field.value, 'inline': field.inline} for field in embed.fields]
-                    } for embed in message.embeds
-                ],
-                'mentions': [str(user) for user in message.mentions],
-                'reactions': [{'emoji': str(reaction.emoji), 'count': reaction.count} for reaction in message.reactions]
-            }
-            messages_data.append(message_info)
-            message_count += 1
-        
-        if not messages_data:
-            await interaction.followup.send("❌ 取得できるメッセージがありませんでした。")
+        if not export_scheduler.can_submit(guild.id):
+            await interaction.followup.send(f"❌ このサーバーでは既に{export_scheduler.queue_limit}件のジョブが待機・実行中です。")
             return
         
-        # JSONファイルとして保存
-        filename = f"messages_{target_channel.name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-        
-        # JSONデータをファイルとして送信
-        json_content = json.dumps(messages_data, ensure_ascii=False, indent=2)
-        
-        # ファイルサイズが大きい場合は分割
-        if len(json_content.encode('utf-8')) > 8000000:  # 8MB制限
-            # 複数のファイルに分割
-            chunk_size = len(messages_data) // 3 + 1
-            for i in range(0, len(messages_data), chunk_size):
-                chunk = messages_data[i:i+chunk_size]
-                chunk_filename = f"messages_{target_channel.name}_part{i//chunk_size + 1}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-                chunk_content = json.dumps(chunk, ensure_ascii=False, indent=2)
-                
-                with open(chunk_filename, 'w', encoding='utf-8') as f:
-                    f.write(chunk_content)
-                
-                with open(chunk_filename, 'rb') as f:
-                    await log_channel.send(
-                        f"📋 メッセージログ (Part {i//chunk_size + 1})\n"
-                        f"元サーバー: {message.guild.name if message.guild else 'DM'}\n"
-                        f"チャンネル: {target_channel.name}\n"
-                        f"メッセージ数: {len(chunk)}\n"
-                        f"取得者: {interaction.user}",
-                        file=discord.File(f, chunk_filename)
-                    )
-                
-                os.remove(chunk_filename)
-        else:
-            with open(filename, 'w', encoding='utf-8') as f:
-                f.write(json_content)
+        await interaction.followup.send(await submit_export_job(interaction, 'export', log_server, target_channel.guild, [target_channel.id], limit, compression, format, incremental, attachments))
             
-            with open(filename, 'rb') as f:
-                await log_channel.send(
-                    f"📋 メッセージログエクスポート完了\n"
-                    f"元サーバー: {message.guild.name if message.guild else 'DM'}\n"
-                    f"チャンネル: {target_channel.name}\n"
-                    f"取得メッセージ数: {message_count}\n"
-                    f"マスカレードメッセージ含む: はい\n"
-                    f"取得者: {interaction.user}",
-                    file=discord.File(f, filename)
-                )
-            
-            os.remove(filename)
-        
-        await interaction.followup.send(f"✅ {message_count}件のメッセージを {log_server.name} に送信しました。")
-            
-    except discord.Forbidden:
-        await interaction.followup.send("❌ メッセージを読む権限がないか、ログサーバーに書き込み権限がありません。")
     except ValueError:
         await interaction.followup.send("❌ 無効なIDが指定されました。数値のIDを入力してください。")
     except Exception as e:
@@ -302,11 +1065,25 @@ async def export_log(interaction: discord.Interaction, log_server_id: str, chann
 @bot.tree.command(name='export_all', description='サーバー内の全チャンネルのメッセージを取得します')
 @app_commands.describe(
     log_server_id='ログを送信するサーバーのID',
-    limit='各チャンネルから取得するメッセージ数（デフォルト: 50）'
+    limit='各チャンネルから取得するメッセージ数（デフォルト: 50）',
+    compression='ファイルの圧縮形式（デフォルト: なし）',
+    format='ファイル形式（デフォルト: JSON、Parquet は pyarrow がなければ CSV）',
+    incremental='前回エクスポートした続きから取得する（初回は最新の指定件数、デフォルト: いいえ）',
+    attachments='添付ファイルをダウンロードしてローカルに保存する（デフォルト: いいえ）'
 )
-async def export_all_channels(interaction: discord.Interaction, log_server_id: str, limit: int = 50):
+@app_commands.choices(compression=[
+    app_commands.Choice(name='なし', value='none'),
+    app_commands.Choice(name='gzip', value='gzip'),
+    app_commands.Choice(name='zstd', value='zstd'),
+], format=[
+    app_commands.Choice(name='JSON', value='json'),
+    app_commands.Choice(name='NDJSON', value='ndjson'),
+    app_commands.Choice(name='CSV', value='csv'),
+    app_commands.Choice(name='Parquet（分析用）', value='parquet'),
+])
+async def export_all_channels(interaction: discord.Interaction, log_server_id: str, limit: int = 50, compression: str = 'none', format: str = 'json', incremental: bool = False, attachments: bool = False):
     """
-    サーバー内の全てのテキストチャンネルからメッセージを取得
+    サーバー内の全てのテキストチャンネルからメッセージを取得するジョブを登録
     """
     await interaction.response.defer()
     
@@ -321,113 +1098,146 @@ async def export_all_channels(interaction: discord.Interaction, log_server_id: s
         return
     
     try:
-        # ログサーバーを取得
-        log_server = bot.get_guild(int(log_server_id))
+        # ログサーバーと送信先チャンネルを取得（固定されたチャンネルか最初の書き込み可能なチャンネル）
+        log_server, log_channel = await resolve_log_server(int(log_server_id))
         if not log_server:
             await interaction.followup.send(f"❌ サーバーID {log_server_id} が見つかりません。")
             return
-        
-        # ログサーバーの最初のテキストチャンネルを取得
-        log_channel = None
-        for channel in log_server.text_channels:
-            if channel.permissions_for(log_server.me).send_messages:
-                log_channel = channel
-                break
-        
         if not log_channel:
             await interaction.followup.send(f"❌ ログサーバー {log_server.name} に書き込み可能なチャンネルが見つかりません。")
             return
         
-        await interaction.followup.send(f"📋 サーバー {guild.name} の全チャンネルからメッセージを取得中...")
-        
-        processed_channels = 0
-        total_messages = 0
-        
-        for channel in guild.text_channels:
-            try:
-                if channel.permissions_for(guild.me).read_message_history:
-                    messages_data = []
-                    message_count = 0
-                    
-                    async for message in channel.history(limit=limit):
-                        message_info = {
-                            'id': str(message.id),
-                            'channel': channel.name,
-                            'channel_id': str(channel.id),
-                            'guild': guild.name,
-                            'guild_id': str(guild.id),
-                            'author': str(message.author),
-                            'author_id': str(message.author.id),
-                            'display_name': message.author.display_name,
-                            'is_webhook': message.webhook_id is not None,
-                            'webhook_id': str(message.webhook_id) if message.webhook_id else None,
-                            'content': message.content,
-                            'timestamp': message.created_at.isoformat(),
-                            'edited_at': message.edited_at.isoformat() if message.edited_at else None,
-                            'attachments': [att.url for att in message.attachments],
-                            'embeds': len(message.embeds),
-                            'embed_details': [
-                                {
-                                    'title': embed.title,
-                                    'description': embed.description,
-                                    'url': embed.url,
-                                    'color': embed.color.value if embed.color else None,
-                                    'timestamp': embed.timestamp.isoformat() if embed.timestamp else None,
-                                    'footer': {'text': embed.footer.text, 'icon_url': embed.footer.icon_url} if embed.footer else None,
-                                    'author': {'name': embed.author.name, 'url': embed.author.url, 'icon_url': embed.author.icon_url} if embed.author else None,
-                                    'thumbnail': embed.thumbnail.url if embed.thumbnail else None,
-                                    'image': embed.image.url if embed.image else None,
-                                    'fields': [{'name': field.name, 'value': field.value, 'inline': field.inline} for field in embed.fields]
-                                } for embed in message.embeds
-                            ],
-                            'mentions': [str(user) for user in message.mentions],
-                            'reactions': [{'emoji': str(reaction.emoji), 'count': reaction.count} for reaction in message.reactions]
-                        }
-                        messages_data.append(message_info)
-                        message_count += 1
-                    
-                    if messages_data:
-                        filename = f"messages_{guild.name}_{channel.name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-                        json_content = json.dumps(messages_data, ensure_ascii=False, indent=2)
-                        
-                        with open(filename, 'w', encoding='utf-8') as f:
-                            f.write(json_content)
-                        
-                        with open(filename, 'rb') as f:
-                            await log_channel.send(
-                                f"📋 チャンネルログ: #{channel.name}\n"
-                                f"サーバー: {guild.name}\n"
-                                f"メッセージ数: {message_count}\n"
-                                f"取得者: {interaction.user}",
-                                file=discord.File(f, filename)
-                            )
-                        
-                        os.remove(filename)
-                        processed_channels += 1
-                        total_messages += message_count
-                    
-                    # レート制限を避けるため少し待機
-                    await asyncio.sleep(1)
-                    
-            except discord.Forbidden:
-                continue
-            except Exception as e:
-                print(f"チャンネル {channel.name} でエラー: {e}")
-                continue
+        if not export_scheduler.can_submit(guild.id):
+            await interaction.followup.send(f"❌ このサーバーでは既に{export_scheduler.queue_limit}件のジョブが待機・実行中です。")
+            return
         
-        await interaction.followup.send(f"✅ 完了: {processed_channels}個のチャンネルから{total_messages}件のメッセージを {log_server.name} に送信しました。")
+        target_channels = [channel.id for channel in guild.text_channels if channel.permissions_for(guild.me).read_message_history]
+        await interaction.followup.send(await submit_export_job(interaction, 'export_all', log_server, guild, target_channels, limit, compression, format, incremental, attachments))
         
     except ValueError:
         await interaction.followup.send("❌ 無効なサーバーIDが指定されました。")
     except Exception as e:
         await interaction.followup.send(f"❌ エラーが発生しました: {str(e)}")
 
+async def get_guild_export_job(interaction, job_id):
+    """コマンドを実行したサーバーのジョブを返す（見つからなければエラーを返信して None）"""
+    job = load_export_job(job_id)
+    if job is None or job.guild_id != interaction.guild.id:
+        await interaction.followup.send(f"❌ ジョブ #{job_id} が見つかりません。")
+        return None
+    return job
+
+@bot.tree.command(name='export_status', description='エクスポートジョブの状態を確認')
+@app_commands.describe(job_id='ジョブID（省略時はこのサーバーの最近のジョブ一覧）')
+async def export_status(interaction: discord.Interaction, job_id: int = None):
+    """
+    エクスポートジョブの状態を表示
+    """
+    await interaction.response.defer()
+    
+    guild = interaction.guild
+    if not guild:
+        await interaction.followup.send("❌ このコマンドはサーバー内でのみ使用できます。")
+        return
+    
+    if job_id is not None:
+        job = await get_guild_export_job(interaction, job_id)
+        if job is not None:
+            await interaction.followup.send(render_export_job(job))
+        return
+    
+    rows = export_job_store.recent(guild.id)
+    if not rows:
+        await interaction.followup.send("📋 このサーバーのエクスポートジョブはありません。")
+        return
+    lines = ["📋 最近のエクスポートジョブ"]
+    for row_id, kind, status, created_at in rows:
+        job = export_scheduler.jobs.get(row_id)
+        if job is not None:
+            status = job.status
+        elif status in ('queued', 'running'):
+            status = 'failed'
+        created = int(datetime.fromisoformat(created_at).timestamp())
+        lines.append(f"#{row_id} /{kind} {STATUS_NAMES.get(status, status)} <t:{created}:R>")
+    await interaction.followup.send("\n".join(lines))
+
+@bot.tree.command(name='export_cancel', description='エクスポートジョブを中止')
+@app_commands.describe(job_id='ジョブID')
+async def export_cancel(interaction: discord.Interaction, job_id: int):
+    """
+    待機中・実行中のエクスポートジョブを中止
+    """
+    await interaction.response.defer()
+    
+    # 権限チェック
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.followup.send("❌ このコマンドを実行するには管理者権限が必要です。")
+        return
+    
+    if not interaction.guild:
+        await interaction.followup.send("❌ このコマンドはサーバー内でのみ使用できます。")
+        return
+    
+    job = await get_guild_export_job(interaction, job_id)
+    if job is None:
+        return
+    was_queued = job.status == 'queued'
+    if not export_scheduler.cancel(job):
+        await interaction.followup.send(f"❌ ジョブ #{job_id} は既に終了しています（{STATUS_NAMES.get(job.status, job.status)}）。")
+        return
+    # 待機中のジョブはここで保存する（実行中のジョブはワーカーが止まった時点で保存する）
+    if was_queued:
+        save_export_job(job)
+    await interaction.followup.send(f"🚫 ジョブ #{job_id} の中止を受け付けました。")
+
+@bot.tree.command(name='export_retry', description='失敗・中止したエクスポートジョブを続きから再開')
+@app_commands.describe(job_id='ジョブID')
+async def export_retry(interaction: discord.Interaction, job_id: int):
+    """
+    失敗・中止したエクスポートジョブをチェックポイントから再開
+    """
+    await interaction.response.defer()
+    
+    # 権限チェック
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.followup.send("❌ このコマンドを実行するには管理者権限が必要です。")
+        return
+    
+    if not interaction.guild:
+        await interaction.followup.send("❌ このコマンドはサーバー内でのみ使用できます。")
+        return
+    
+    job = await get_guild_export_job(interaction, job_id)
+    if job is None:
+        return
+    if job.status not in ('failed', 'cancelled'):
+        await interaction.followup.send(f"❌ ジョブ #{job_id} は再開できません（{STATUS_NAMES.get(job.status, job.status)}）。")
+        return
+    if not export_scheduler.can_submit(job.guild_id):
+        await interaction.followup.send(f"❌ このサーバーでは既に{export_scheduler.queue_limit}件のジョブが待機・実行中です。")
+        return
+    
+    # 進捗は再開を依頼したチャンネルに表示する
+    job.params['notify_channel_id'] = interaction.channel.id
+    job.params['requester'] = str(interaction.user)
+    job.params['requester_id'] = interaction.user.id
+    export_scheduler.start()
+    waiting = export_scheduler.submit(job)
+    save_export_job(job)
+    await interaction.followup.send(f"🔁 ジョブ #{job_id} を再開します（{job.exported_messages()}件送信済み, 前に待機中のジョブ: {waiting}件）。")
+
 @bot.tree.command(name='start_logging', description='指定したサーバーで継続的にログを記録開始')
 @app_commands.describe(
     log_server_id='ログを送信するサーバーのID',
-    channels='監視するチャンネルIDのリスト（カンマ区切り、省略時は全チャンネル）'
+    channels='監視するチャンネルIDのリスト（カンマ区切り、省略時は全チャンネル）',
+    mode='ログの送信方法（デフォルト: メッセージごと + 時間別ファイル）'
 )
-async def start_continuous_logging(interaction: discord.Interaction, log_server_id: str, channels: str = None):
+@app_commands.choices(mode=[
+    app_commands.Choice(name='メッセージごと + 時間別ファイル', value='embed'),
+    app_commands.Choice(name='時間別ファイルのみ', value='rollup'),
+    app_commands.Choice(name='チャンネルごとにまとめて + 時間別ファイル', value='digest'),
+])
+async def start_continuous_logging(interaction: discord.Interaction, log_server_id: str, channels: str = None, mode: str = 'embed'):
     """
     継続的なログ記録を開始
     """
@@ -444,19 +1254,12 @@ async def start_continuous_logging(interaction: discord.Interaction, log_server_
         return
     
     try:
-        # ログサーバーを取得
-        log_server = bot.get_guild(int(log_server_id))
+        # ログサーバーと送信先チャンネルを取得（固定されたチャンネルか最初の書き込み可能なチャンネル）
+        log_server, log_channel = await resolve_log_server(int(log_server_id))
         if not log_server:
             await interaction.followup.send(f"❌ サーバーID {log_server_id} が見つかりません。")
             return
         
-        # ログサーバーの書き込み可能なチャンネルを取得
-        log_channel = None
-        for channel in log_server.text_channels:
-            if channel.permissions_for(log_server.me).send_messages:
-                log_channel = channel
-                break
-        
         if not log_channel:
             await interaction.followup.send(f"❌ ログサーバー {log_server.name} に書き込み可能なチャンネルが見つかりません。")
             return
@@ -469,17 +1272,13 @@ async def start_continuous_logging(interaction: discord.Interaction, log_server_
                 try:
                     channel = bot.get_channel(int(ch_id))
                     if channel and channel.guild == guild:
-                        target_channels.append(ch_id)
+                        target_channels.append(channel.id)
                 except ValueError:
                     continue
         
-        # 継続ログ設定を保存
-        continuous_logging[str(guild.id)] = {
-            'log_server_id': log_server_id,
-            'channels': target_channels,  # 空の場合は全チャンネル
-            'log_channel': log_channel,
-            'last_json_hour': datetime.now().hour
-        }
+        # 継続ログ設定を保存（channels が空の場合は全チャンネル）
+        continuous_logging[guild.id] = LoggingConfig(guild.id, log_server.id, log_channel.id, target_channels, mode, log_channel)
+        logging_config_store.save(guild.id, log_server.id, log_channel.id, target_channels, mode)
         
         # 開始通知をログサーバーに送信
         start_embed = discord.Embed(
@@ -494,7 +1293,7 @@ async def start_continuous_logging(interaction: discord.Interaction, log_server_
         if target_channels:
             channel_names = []
             for ch_id in target_channels:
-                channel = bot.get_channel(int(ch_id))
+                channel = bot.get_channel(ch_id)
                 if channel:
                     channel_names.append(f"#{channel.name}")
             start_embed.add_field(name="監視チャンネル", value="\n".join(channel_names), inline=False)
@@ -530,11 +1329,31 @@ async def stop_continuous_logging(interaction: discord.Interaction):
         await interaction.followup.send("❌ このコマンドはサーバー内でのみ使用できます。")
         return
     
-    guild_id = str(guild.id)
+    log_config = continuous_logging.get(guild.id)
     
-    if guild_id in continuous_logging:
-        log_config = continuous_logging[guild_id]
-        log_channel = log_config['log_channel']
+    if log_config is not None:
+        log_channel = resolve_log_channel(log_config)
+        
+        # 先に設定を削除して、これ以降のイベントをパイプラインに入れないようにする
+        del continuous_logging[guild.id]
+        logging_config_store.delete(guild.id)
+        
+        # 処理待ちのイベントを処理してからパイプラインを停止（処理しきれない分は時間を区切って破棄）
+        pipeline = pipelines.pop(guild.id, None)
+        discarded = await pipeline.close() if pipeline else 0
+        
+        # まとめ途中のメッセージを送信キューに追加
+        await send_digests(digest_buffer.pop_guild(guild.id), log_config)
+        
+        # 未送信の時間別ログを送信
+        try:
+            await rollup_journal(log_config, force=True)
+        except Exception as e:
+            print(f"時間別ログ送信エラー (サーバー {guild.id}): {e}")
+        journals.pop(guild.id, None)
+        
+        # 他のサーバーが使っていない送信キューは残りを送信して停止
+        await close_unused_log_queue(log_config.log_channel_id)
         
         # 停止通知をログサーバーに送信
         stop_embed = discord.Embed(
@@ -543,20 +1362,29 @@ async def stop_continuous_logging(interaction: discord.Interaction):
             timestamp=datetime.now(timezone.utc)
         )
         stop_embed.add_field(name="対象サーバー", value=guild.name, inline=True)
-        stop_embed.add_field(name="サーバーID", value=guild_id, inline=True)
+        stop_embed.add_field(name="サーバーID", value=str(guild.id), inline=True)
         stop_embed.add_field(name="停止者", value=str(interaction.user), inline=True)
         
         try:
-            await log_channel.send(embed=stop_embed)
+            if log_channel:
+                await log_channel.send(embed=stop_embed)
         except:
             pass  # ログサーバーに送信できなくても継続
         
-        # 設定を削除
-        del continuous_logging[guild_id]
-        await interaction.followup.send("✅ 継続ログ記録を停止しました。")
+        message = "✅ 継続ログ記録を停止しました。"
+        if discarded:
+            message += f"\n⚠️ 転送待ちだった {discarded} 件のメッセージはログチャンネルに送信されませんでした（時間別ログには記録済みです）。"
+        await interaction.followup.send(message)
     else:
         await interaction.followup.send("❌ このサーバーでは継続ログ記録が開始されていません。")
 
+# 継続ログの送信方法の表示名
+LOGGING_MODE_NAMES = {
+    'embed': "メッセージごと + 時間別ファイル",
+    'rollup': "時間別ファイルのみ",
+    'digest': "チャンネルごとにまとめて + 時間別ファイル",
+}
+
 @bot.tree.command(name='logging_status', description='継続ログ記録の状態を確認')
 async def logging_status(interaction: discord.Interaction):
     """
@@ -569,11 +1397,10 @@ async def logging_status(interaction: discord.Interaction):
         await interaction.followup.send("❌ このコマンドはサーバー内でのみ使用できます。")
         return
     
-    guild_id = str(guild.id)
+    log_config = continuous_logging.get(guild.id)
     
-    if guild_id in continuous_logging:
-        log_config = continuous_logging[guild_id]
-        log_server = bot.get_guild(int(log_config['log_server_id']))
+    if log_config is not None:
+        log_server = bot.get_guild(log_config.log_server_id)
         
         status_embed = discord.Embed(
             title="📊 継続ログ記録状態",
@@ -581,13 +1408,61 @@ async def logging_status(interaction: discord.Interaction):
             timestamp=datetime.now(timezone.utc)
         )
         status_embed.add_field(name="状態", value="🟢 記録中", inline=True)
-        status_embed.add_field(name="ログ送信先", value=log_server.name if log_server else "不明", inline=True)
-        status_embed.add_field(name="ログチャンネル", value=f"#{log_config['log_channel'].name}", inline=True)
+        status_embed.add_field(name="ログ送信先", value=log_server.name if log_server else str(log_config.log_server_id), inline=True)
+        log_channel = resolve_log_channel(log_config)
+        status_embed.add_field(name="ログチャンネル", value=f"#{getattr(log_channel, 'name', log_channel.id)}" if log_channel else "不明", inline=True)
+        status_embed.add_field(name="送信方法", value=LOGGING_MODE_NAMES.get(log_config.mode, log_config.mode), inline=True)
+        if log_config.mode == 'digest':
+            digest_stats = digest_buffer.stats()
+            status_embed.add_field(
+                name="まとめ",
+                value=f"{digest_stats['messages']}件 → {digest_stats['embeds']}個の埋め込み（まとめ中: {digest_stats['pending']}件）",
+                inline=False
+            )
+        
+        cache_stats = message_cache.stats()
+        status_embed.add_field(
+            name="メッセージキャッシュ",
+            value=f"{cache_stats['size']}/{cache_stats['max_size']}件 (ヒット: {cache_stats['hits']} / ミス: {cache_stats['misses']})",
+            inline=False
+        )
+        
+        journal = journals.get(guild.id)
+        if journal and journal.file is not None:
+            status_embed.add_field(name="時間別ログ（未送信）", value=f"{journal.count}件 ({journal.size // 1024}KB)", inline=True)
+        
+        pipeline = pipelines.get(guild.id)
+        if pipeline:
+            stats = pipeline.stats()
+            status_embed.add_field(
+                name="処理パイプライン",
+                value=(
+                    f"処理待ち: {stats['queued']}件 (最も古いもの: {stats['lag']:.2f}秒前) / 重み: {stats['weight']}\n"
+                    f"処理済み: {stats['processed']}件 / 破棄: {stats['dropped']}件 / エラー: {stats['errors']}件\n"
+                    f"遅延: 直近 {stats['last_lag'] * 1000:.0f}ms / 最大 {stats['max_lag'] * 1000:.0f}ms"
+                ),
+                inline=False
+            )
         
-        if log_config['channels']:
+        queue = log_queues.get(log_config.log_channel_id)
+        if queue:
+            stats = queue.stats()
+            status_embed.add_field(
+                name="送信キュー",
+                value=(
+                    f"待機中: {stats['queued']}件\n"
+                    f"送信済み: {stats['sent_embeds']}件 ({stats['sent_batches']}回)\n"
+                    f"溢れ: {stats['overflows']}回 / 破棄: {stats['dropped']}件\n"
+                    f"送信エラー: {stats['send_errors']}回 / 再試行: {stats['retries']}回\n"
+                    f"退避中: {stats['spill_pending']}件 (再送済み: {stats['replayed']}件) / ブレーカー: {stats['circuit']}"
+                ),
+                inline=False
+            )
+        
+        if log_config.channels:
             channel_names = []
-            for ch_id in log_config['channels']:
-                channel = bot.get_channel(int(ch_id))
+            for ch_id in log_config.channels:
+                channel = bot.get_channel(ch_id)
                 if channel:
                     channel_names.append(f"#{channel.name}")
             status_embed.add_field(name="監視チャンネル", value="\n".join(channel_names), inline=False)
@@ -604,9 +1479,174 @@ async def logging_status(interaction: discord.Interaction):
         status_embed.add_field(name="状態", value="🔴 停止中", inline=True)
         await interaction.followup.send(embed=status_embed)
 
-def run_flask():
-    """Flaskサーバーを別スレッドで起動"""
-    app.run(host='0.0.0.0', port=5000, debug=False)
+@bot.tree.command(name='set_log_channel', description='このサーバーをログサーバーにするときの送信先チャンネルを固定')
+@app_commands.describe(channel='送信先にするチャンネル（省略時は固定を解除して最初の書き込み可能なチャンネルを使う）')
+async def set_log_channel(interaction: discord.Interaction, channel: discord.TextChannel = None):
+    """
+    ログの送信先チャンネルを固定
+    """
+    await interaction.response.defer()
+    
+    # 権限チェック
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.followup.send("❌ このコマンドを実行するには管理者権限が必要です。")
+        return
+    
+    guild = interaction.guild
+    if not guild:
+        await interaction.followup.send("❌ このコマンドはサーバー内でのみ使用できます。")
+        return
+    
+    if channel is None:
+        destination_resolver.unpin(guild.id)
+        log_channel = destination_resolver.resolve(guild)
+        current = f"#{log_channel.name}" if log_channel else "なし"
+        await interaction.followup.send(f"✅ 送信先の固定を解除しました。現在の送信先: {current}")
+        return
+    
+    if not is_writable(channel):
+        await interaction.followup.send(f"❌ #{channel.name} に書き込む権限がありません。")
+        return
+    
+    destination_resolver.pin(guild.id, channel.id)
+    await interaction.followup.send(f"✅ このサーバーへのログの送信先を #{channel.name} に固定しました。")
+
+@bot.tree.command(name='search', description='ローカルアーカイブからメッセージを検索します')
+@app_commands.describe(
+    text='本文に含まれる文字列',
+    author='投稿者',
+    channel='チャンネル',
+    since='この日時以降（例: 2024-01-31 または 2024-01-31T12:00、UTC）',
+    until='この日時より前（例: 2024-02-01、UTC）',
+    limit='表示する件数（デフォルト: 20）'
+)
+async def search_archive(interaction: discord.Interaction, text: str = None, author: discord.User = None, channel: discord.TextChannel = None, since: str = None, until: str = None, limit: app_commands.Range[int, 1, 50] = 20):
+    """
+    継続ログとエクスポートで保存したメッセージを検索
+    """
+    await interaction.response.defer()
+    
+    # 権限チェック
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.followup.send("❌ このコマンドを実行するには管理者権限が必要です。")
+        return
+    
+    guild = interaction.guild
+    if not guild:
+        await interaction.followup.send("❌ このコマンドはサーバー内でのみ使用できます。")
+        return
+    
+    try:
+        # 期間はメッセージID（Snowflake）の範囲に変換して主キーで検索
+        after_id = before_id = None
+        if since:
+            since_dt = datetime.fromisoformat(since)
+            after_id = discord.utils.time_snowflake(since_dt if since_dt.tzinfo else since_dt.replace(tzinfo=timezone.utc), high=False) - 1
+        if until:
+            until_dt = datetime.fromisoformat(until)
+            before_id = discord.utils.time_snowflake(until_dt if until_dt.tzinfo else until_dt.replace(tzinfo=timezone.utc), high=False)
+        
+        results = archive.search(
+            guild.id,
+            channel_id=channel.id if channel else None,
+            author_id=author.id if author else None,
+            after_id=after_id,
+            before_id=before_id,
+            text=text,
+            limit=limit
+        )
+    except ValueError:
+        await interaction.followup.send("❌ 日時の形式が正しくありません。例: 2024-01-31 または 2024-01-31T12:00")
+        return
+    except Exception as e:
+        await interaction.followup.send(f"❌ エラーが発生しました: {str(e)}")
+        return
+    
+    if not results:
+        await interaction.followup.send("🔍 条件に一致するメッセージは見つかりませんでした。")
+        return
+    
+    # 埋め込みの説明文の上限（4096文字）に収まるだけ表示
+    lines = []
+    length = 0
+    for message_id, channel_id, channel_name, author_name, content, timestamp in results:
+        content = (content or "（本文なし）").replace("\n", " ")
+        if len(content) > 150:
+            content = content[:150] + "..."
+        created_at = int(discord.utils.snowflake_time(message_id).timestamp())
+        line = f"[#{channel_name}](https://discord.com/channels/{guild.id}/{channel_id}/{message_id}) <t:{created_at}:f> **{discord.utils.escape_markdown(author_name)}**: {discord.utils.escape_markdown(content)}"
+        if length + len(line) + 1 > 4096:
+            break
+        lines.append(line)
+        length += len(line) + 1
+    
+    result_embed = discord.Embed(
+        title=f"🔍 検索結果 ({len(lines)}件)",
+        description="\n".join(lines),
+        color=0x3498db,
+        timestamp=datetime.now(timezone.utc)
+    )
+    await interaction.followup.send(embed=result_embed)
+
+async def run_bot(token):
+    """Webサーバーと同じイベントループでBotを起動"""
+    runner = await start_web_server()
+    # SIGTERM（複数プロセス起動時の親プロセスからの停止など）でも後片付けをしてから終了する
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: asyncio.create_task(bot.close()))
+    except NotImplementedError:
+        pass
+    try:
+        async with bot:
+            await bot.start(token)
+    finally:
+        await attachment_mirror.close()
+        await runner.cleanup()
+
+def launch_shard_processes():
+    """
+    SHARD_COUNT 個のシャードを SHARD_PROCESSES 個のプロセスに分けて起動
+    各プロセスは同じデータベースの継続ログ設定を共有し、Webサーバーは PORT から順に別のポートを使う
+    """
+    processes = []
+    for index in range(SHARD_PROCESSES):
+        shard_ids = range(index, SHARD_COUNT, SHARD_PROCESSES)
+        if not shard_ids:
+            continue
+        env = dict(
+            os.environ,
+            SHARD_IDS=','.join(str(shard_id) for shard_id in shard_ids),
+            SHARD_COUNT=str(SHARD_COUNT),
+            SHARD_PROCESSES='1',
+            PORT=str(WEB_PORT + index)
+        )
+        processes.append(subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env))
+        print(f"シャード {env['SHARD_IDS']} をプロセス {processes[-1].pid} で起動しました（ポート {env['PORT']}）")
+    
+    # SIGTERM・SIGINT を受け取ったら子プロセスに SIGTERM を送り、全て終了するまで待つ
+    # （端末の Ctrl+C は子プロセスにも SIGINT が届くので、同じシグナルを重ねて送らない）
+    stopping = False
+    def forward_signal(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+    signal.signal(signal.SIGTERM, forward_signal)
+    signal.signal(signal.SIGINT, forward_signal)
+    
+    # どれかのプロセスが落ちた場合は、担当シャードが動かないまま残らないように全て止めて異常終了する
+    exit_code = 0
+    while True:
+        for process in processes:
+            if process.poll() and not stopping:
+                print(f"プロセス {process.pid} が終了コード {process.returncode} で終了したため、他のシャードも停止します")
+                exit_code = 1
+                forward_signal(signal.SIGTERM, None)
+        if all(process.returncode is not None for process in processes):
+            break
+        time.sleep(1)
+    sys.exit(exit_code)
 
 # Botを起動
 if __name__ == "__main__":
@@ -614,13 +1654,14 @@ if __name__ == "__main__":
     if not TOKEN:
         print("DISCORD_BOT_TOKEN環境変数が設定されていません。")
         print("Secretsタブでトークンを設定してください。")
-        # トークンがない場合でもFlaskサーバーだけ起動
-        app.run(host='0.0.0.0', port=5000, debug=False)
+        # トークンがない場合でもWebサーバーだけ起動
+        web.run_app(app, host='0.0.0.0', port=WEB_PORT)
+    elif SHARD_PROCESSES > 1:
+        if not SHARD_COUNT:
+            print("SHARD_PROCESSES を使う場合は SHARD_COUNT を設定してください。")
+        else:
+            launch_shard_processes()
     else:
-        # Flaskサーバーを別スレッドで起動
-        flask_thread = threading.Thread(target=run_flask, daemon=True)
-        flask_thread.start()
-        print("Flask web server started on http://0.0.0.0:5000")
-        
-        # Discord botを起動
-        bot.run(TOKEN)
+        # bot.run と同じようにログを設定してから起動
+        discord.utils.setup_logging()
+        asyncio.run(run_bot(TOKEN))
@@ -0,0 +1,58 @@
+import os
+from collections import OrderedDict
+
+# 編集・削除の差分用に保持するメッセージ数
+MESSAGE_CACHE_SIZE = int(os.getenv('MESSAGE_CACHE_SIZE', 5000))
+
+
+class MessageCache:
+    """
+    最近記録したメッセージ情報（serializer の辞書）のLRUキャッシュ
+    max_size 件を超えたら最も古く使われたものから破棄する
+    """
+
+    def __init__(self, max_size=MESSAGE_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+
+        # 統計カウンター
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def put(self, message_id, record):
+        """メッセージ情報を追加（既にあれば更新）"""
+        self.entries[message_id] = record
+        self.entries.move_to_end(message_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, message_id):
+        """メッセージ情報を返す（なければ None）"""
+        record = self.entries.get(message_id)
+        if record is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(message_id)
+        return record
+
+    def pop(self, message_id):
+        """メッセージ情報を取り出して削除（なければ None）"""
+        record = self.entries.pop(message_id, None)
+        if record is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return record
+
+    def stats(self):
+        """統計情報を辞書で返す"""
+        return {
+            'size': len(self.entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
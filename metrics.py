@@ -0,0 +1,184 @@
+import threading
+import time
+
+import aiohttp
+
+# Prometheus形式のメトリクス
+# 各メトリクスはロックで保護しているので、イベントループ以外のスレッドから更新・読み取りしてもよい
+
+# ヒストグラムの既定のバケット（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Counter:
+    """増加のみするカウンター"""
+
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        with self.lock:
+            values = list(self.values.items())
+        return [f'{self.name}{_format_labels(self.labels, key)} {value}' for key, value in values]
+
+
+class Histogram:
+    """値の分布を累積バケットで記録するヒストグラム"""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # フォーマット: {label_values: [バケットごとの件数..., 合計, 件数]}
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            entry = self.values.get(label_values)
+            if entry is None:
+                entry = [0] * (len(self.buckets) + 2)
+                self.values[label_values] = entry
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+                    break
+            entry[-2] += value
+            entry[-1] += 1
+
+    def time(self, *label_values):
+        """with 文で囲んだ処理の所要時間を記録する"""
+        return _Timer(self, label_values)
+
+    def render(self):
+        with self.lock:
+            values = [(key, list(entry)) for key, entry in self.values.items()]
+        lines = []
+        for key, entry in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, [("le", bound)])} {cumulative}')
+            lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, [("le", "+Inf")])} {entry[-1]}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {entry[-2]}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {entry[-1]}')
+        return lines
+
+
+class _Timer:
+    __slots__ = ('histogram', 'label_values', 'start')
+
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.label_values)
+
+
+class Gauge:
+    """読み取り時に関数を呼んで現在の値を返すゲージ（関数は [(label_values, value)] を返す）"""
+
+    type = 'gauge'
+
+    def __init__(self, name, help, labels=(), collect=None):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.collect = collect
+
+    def render(self):
+        return [f'{self.name}{_format_labels(self.labels, key)} {value}' for key, value in self.collect()]
+
+
+class Registry:
+    """メトリクスをまとめてテキスト形式で出力する"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+messages_seen = registry.register(Counter(
+    'logger_messages_seen_total', '継続ログの対象として受信したメッセージ数', ('guild_id',)))
+messages_forwarded = registry.register(Counter(
+    'logger_messages_forwarded_total', 'ログチャンネルの送信キューに追加したメッセージ数', ('guild_id',)))
+send_seconds = registry.register(Histogram(
+    'logger_send_seconds', 'ログチャンネルへの送信にかかった時間'))
+send_errors = registry.register(Counter(
+    'logger_send_errors_total', 'ログチャンネルへの送信エラー数'))
+send_retries = registry.register(Counter(
+    'logger_send_retries_total', 'ログチャンネルへの送信を再試行した回数'))
+spilled_embeds = registry.register(Counter(
+    'logger_spilled_embeds_total', '送信できずディスクに退避した埋め込みの数'))
+rate_limited = registry.register(Counter(
+    'discord_rate_limited_total', 'Discord APIから429が返された回数', ('method',)))
+http_seconds = registry.register(Histogram(
+    'discord_http_seconds', 'Discord APIへのリクエストにかかった時間', ('method',)))
+export_seconds = registry.register(Histogram(
+    'export_seconds', 'エクスポートにかかった時間', ('command',),
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)))
+uploaded_bytes = registry.register(Counter(
+    'export_uploaded_bytes_total', 'アップロードしたファイルのバイト数', ('prefix',)))
+pipeline_lag_seconds = registry.register(Histogram(
+    'logger_pipeline_lag_seconds', '継続ログのイベントを受け取ってから処理を終えるまでの時間', ('guild_id',)))
+pipeline_dropped = registry.register(Counter(
+    'logger_pipeline_dropped_total', '処理待ちが上限を超えて破棄した継続ログのイベント数', ('guild_id',)))
+serialize_seconds = registry.register(Histogram(
+    'serialize_seconds', 'メッセージ情報の変換にかかった時間',
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.005)))
+
+
+def trace_config():
+    """Discord APIへのリクエスト時間と429を記録する aiohttp の TraceConfig"""
+    config = aiohttp.TraceConfig()
+
+    async def on_request_start(session, context, params):
+        context.start = time.perf_counter()
+
+    async def on_request_end(session, context, params):
+        http_seconds.observe(time.perf_counter() - context.start, params.method)
+        if params.response.status == 429:
+            rate_limited.inc(params.method)
+
+    config.on_request_start.append(on_request_start)
+    config.on_request_end.append(on_request_end)
+    return config
@@ -0,0 +1,161 @@
+import asyncio
+import os
+import time
+from collections import deque
+
+import metrics
+
+# サーバーごとの処理待ちイベント数の上限（超えた分は破棄する）
+PIPELINE_QUEUE_SIZE = int(os.getenv('LOG_PIPELINE_QUEUE_SIZE', 5000))
+# 重み1あたり、1回の順番で続けて処理するイベント数
+PIPELINE_QUANTUM = int(os.getenv('LOG_PIPELINE_QUANTUM', 8))
+# 停止時に処理待ちのイベントを処理する最大秒数（超えた分は破棄する）
+PIPELINE_CLOSE_TIMEOUT = float(os.getenv('LOG_PIPELINE_CLOSE_TIMEOUT', 10))
+
+
+def parse_weights(text):
+    """
+    環境変数 LOG_PIPELINE_WEIGHTS の値を辞書に変換
+    フォーマット: "guild_id:weight,guild_id:weight"（指定のないサーバーの重みは1）
+    """
+    weights = {}
+    for entry in (text or '').split(','):
+        if not entry.strip():
+            continue
+        guild_id, _, weight = entry.partition(':')
+        weights[int(guild_id)] = max(1, int(weight or 1))
+    return weights
+
+
+class GuildPipeline:
+    """
+    サーバーごとの継続ログの処理パイプライン
+    イベントを上限付きのキューに入れてすぐに戻り、サーバー専用のワーカーが受け取った順に処理する
+    送信先が遅い・レート制限中のサーバーはそのワーカーだけが待つので、他のサーバーの処理は遅れない
+
+    ワーカーは weight * quantum 件続けて処理するとイベントループに順番を譲るので、
+    処理待ちがあるサーバー同士は重みに比例した件数ずつ交互に処理される（重み付きラウンドロビン）
+    """
+
+    def __init__(self, guild_id, weight=1, maxsize=PIPELINE_QUEUE_SIZE, quantum=PIPELINE_QUANTUM):
+        self.guild_id = guild_id
+        self.weight = weight
+        self.maxsize = maxsize
+        self.quantum = quantum
+        # フォーマット: deque[(受け取った時刻, handler, args)]
+        self.events = deque()
+        self.wakeup = asyncio.Event()
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.worker = None
+        # ワーカーが処理中のイベント（停止時に途中で打ち切った場合は破棄した件数に含める）
+        self.current = None
+
+        # 統計カウンター
+        self.enqueued = 0
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        # 直近に処理したイベントと、これまでで最大の遅延（受け取ってから処理を終えるまでの秒数）
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def start(self):
+        """ワーカータスクを起動"""
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.create_task(self._run())
+
+    def submit(self, handler, *args):
+        """イベントを処理待ちに追加（満杯の場合は破棄して False を返す）"""
+        if len(self.events) >= self.maxsize:
+            self.dropped += 1
+            metrics.pipeline_dropped.inc(self.guild_id)
+            return False
+        self.events.append((time.monotonic(), handler, args))
+        self.enqueued += 1
+        self.idle.clear()
+        self.wakeup.set()
+        return True
+
+    async def _process(self, event):
+        received, handler, args = event
+        try:
+            await handler(*args)
+        except Exception as e:
+            self.errors += 1
+            print(f"継続ログの処理でエラー (サーバー {self.guild_id}): {e}")
+        lag = time.monotonic() - received
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        self.processed += 1
+        metrics.pipeline_lag_seconds.observe(lag, self.guild_id)
+
+    async def _run(self):
+        while True:
+            if not self.events:
+                self.idle.set()
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            for _ in range(self.weight * self.quantum):
+                if not self.events:
+                    break
+                self.current = self.events.popleft()
+                await self._process(self.current)
+                self.current = None
+            # 処理待ちの他のサーバーに順番を譲る
+            await asyncio.sleep(0)
+
+    async def join(self):
+        """処理待ちのイベントがなくなるまで待つ"""
+        await self.idle.wait()
+
+    async def close(self, timeout=PIPELINE_CLOSE_TIMEOUT):
+        """
+        処理待ちのイベントを処理してからワーカーを停止
+        timeout 秒以内に処理しきれなかったイベントは破棄し、破棄した件数を返す
+        """
+        if self.worker is not None:
+            try:
+                await asyncio.wait_for(self.join(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self.worker.cancel()
+            try:
+                await self.worker
+            except asyncio.CancelledError:
+                pass
+            self.worker = None
+        else:
+            # ワーカーが起動していない場合は期限内に自分で処理する
+            deadline = time.monotonic() + timeout
+            while self.events and time.monotonic() < deadline:
+                await self._process(self.events.popleft())
+
+        discarded = len(self.events) + (self.current is not None)
+        self.current = None
+        if discarded:
+            self.dropped += discarded
+            metrics.pipeline_dropped.inc(self.guild_id, amount=discarded)
+            self.events.clear()
+            print(f"継続ログのパイプライン停止時に {discarded} 件のイベントを破棄しました (サーバー {self.guild_id})")
+        self.idle.set()
+        return discarded
+
+    def lag(self):
+        """処理待ちで最も古いイベントの待ち時間（秒、処理待ちがなければ0）"""
+        return time.monotonic() - self.events[0][0] if self.events else 0.0
+
+    def stats(self):
+        """統計情報を辞書で返す"""
+        return {
+            'queued': len(self.events),
+            'enqueued': self.enqueued,
+            'processed': self.processed,
+            'dropped': self.dropped,
+            'errors': self.errors,
+            'weight': self.weight,
+            'lag': self.lag(),
+            'last_lag': self.last_lag,
+            'max_lag': self.max_lag,
+        }
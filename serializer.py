@@ -0,0 +1,92 @@
+# メッセージをJSON用の辞書に変換する共通シリアライザー
+# on_message / export / export_all の全てでこのモジュールを使う
+
+# 投稿者の文字列表現のキャッシュ
+# フォーマット: {author_id: (name, display_name, str(author), str(author_id))}
+_author_cache = {}
+AUTHOR_CACHE_SIZE = 10000
+
+
+def _render_author(author):
+    """投稿者の文字列表現を返す（名前が変わっていなければキャッシュを使う）"""
+    name = author.name
+    display_name = author.display_name
+    cached = _author_cache.get(author.id)
+    if cached is not None and cached[0] == name and cached[1] == display_name:
+        return cached
+    if len(_author_cache) >= AUTHOR_CACHE_SIZE:
+        _author_cache.clear()
+    cached = (name, display_name, str(author), str(author.id))
+    _author_cache[author.id] = cached
+    return cached
+
+
+def serialize_embed(embed):
+    """埋め込みを辞書に変換"""
+    footer = embed.footer
+    author = embed.author
+    timestamp = embed.timestamp
+    color = embed.color
+    return {
+        'title': embed.title,
+        'description': embed.description,
+        'url': embed.url,
+        'color': color.value if color else None,
+        'timestamp': timestamp.isoformat() if timestamp else None,
+        'footer': {'text': footer.text, 'icon_url': footer.icon_url} if footer else None,
+        'author': {'name': author.name, 'url': author.url, 'icon_url': author.icon_url} if author else None,
+        'thumbnail': embed.thumbnail.url if embed.thumbnail else None,
+        'image': embed.image.url if embed.image else None,
+        'fields': [{'name': field.name, 'value': field.value, 'inline': field.inline} for field in embed.fields]
+    }
+
+
+class MessageSerializer:
+    """
+    同じチャンネルのメッセージをまとめて変換するシリアライザー
+    チャンネル・サーバーの文字列は生成時に一度だけ計算する
+    """
+
+    __slots__ = ('channel_name', 'channel_id', 'guild_name', 'guild_id')
+
+    def __init__(self, channel, guild):
+        self.channel_name = channel.name
+        self.channel_id = str(channel.id)
+        self.guild_name = guild.name if guild else 'DM'
+        self.guild_id = str(guild.id) if guild else None
+
+    def serialize(self, message):
+        """メッセージを辞書に変換"""
+        _, display_name, author, author_id = _render_author(message.author)
+        webhook_id = message.webhook_id
+        edited_at = message.edited_at
+        embeds = message.embeds
+        attachments = message.attachments
+        mentions = message.mentions
+        reactions = message.reactions
+        return {
+            'id': str(message.id),
+            'channel': self.channel_name,
+            'channel_id': self.channel_id,
+            'guild': self.guild_name,
+            'guild_id': self.guild_id,
+            'author': author,
+            'author_id': author_id,
+            'display_name': display_name,
+            'is_webhook': webhook_id is not None,
+            'webhook_id': str(webhook_id) if webhook_id else None,
+            'content': message.content,
+            'timestamp': message.created_at.isoformat(),
+            'edited_at': edited_at.isoformat() if edited_at else None,
+            'attachments': [att.url for att in attachments] if attachments else [],
+            'embeds': len(embeds),
+            # 埋め込みがないメッセージ（大半）は走査しない
+            'embed_details': [serialize_embed(embed) for embed in embeds] if embeds else [],
+            'mentions': [_render_author(user)[2] for user in mentions] if mentions else [],
+            'reactions': [{'emoji': str(reaction.emoji), 'count': reaction.count} for reaction in reactions] if reactions else []
+        }
+
+
+def serialize_message(message):
+    """単発のメッセージを辞書に変換（on_message用）"""
+    return MessageSerializer(message.channel, message.guild).serialize(message)
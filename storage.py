@@ -0,0 +1,368 @@
+import json
+import os
+import sqlite3
+from datetime import datetime, timezone
+
+# Botの状態を保存するSQLiteデータベースのパス
+DB_PATH = os.getenv('BOT_DB_PATH', 'bot_state.db')
+
+
+def connect(path=DB_PATH):
+    """データベースに接続（WALモードで書き込み中も読み取りをブロックしない）"""
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+class CursorStore:
+    """
+    チャンネルごとのエクスポート済み位置（最後に送信したメッセージID）を保存する
+    送信先サーバーが違えば別々に記録する
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS export_cursors (
+                channel_id INTEGER NOT NULL,
+                destination_id INTEGER NOT NULL,
+                last_message_id INTEGER NOT NULL,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (channel_id, destination_id)
+            )
+        ''')
+        self.conn.commit()
+
+    def get(self, channel_id, destination_id):
+        """最後にエクスポートしたメッセージIDを返す（未エクスポートなら None）"""
+        row = self.conn.execute(
+            'SELECT last_message_id FROM export_cursors WHERE channel_id = ? AND destination_id = ?',
+            (channel_id, destination_id)
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, channel_id, destination_id, message_id):
+        """エクスポート済み位置を更新（古いIDで巻き戻さない）"""
+        self.conn.execute('''
+            INSERT INTO export_cursors (channel_id, destination_id, last_message_id, updated_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (channel_id, destination_id) DO UPDATE SET
+                last_message_id = MAX(last_message_id, excluded.last_message_id),
+                updated_at = excluded.updated_at
+        ''', (channel_id, destination_id, message_id, datetime.now(timezone.utc).isoformat()))
+        self.conn.commit()
+
+
+class DestinationPinStore:
+    """
+    管理者が固定したログサーバーごとの送信先チャンネルを保存する
+    フォーマット: {log_server_id: channel_id}
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS destination_pins (
+                log_server_id INTEGER PRIMARY KEY,
+                channel_id INTEGER NOT NULL
+            )
+        ''')
+        self.conn.commit()
+
+    def load_all(self):
+        """固定されている送信先を辞書で返す"""
+        return dict(self.conn.execute('SELECT log_server_id, channel_id FROM destination_pins'))
+
+    def save(self, log_server_id, channel_id):
+        """送信先を固定（既にあれば上書き）"""
+        self.conn.execute(
+            'INSERT OR REPLACE INTO destination_pins (log_server_id, channel_id) VALUES (?, ?)',
+            (log_server_id, channel_id)
+        )
+        self.conn.commit()
+
+    def delete(self, log_server_id):
+        """固定を解除"""
+        self.conn.execute('DELETE FROM destination_pins WHERE log_server_id = ?', (log_server_id,))
+        self.conn.commit()
+
+
+class ExportJobStore:
+    """
+    エクスポートジョブの状態とチェックポイントを保存する（失敗したジョブを再開するため）
+    params と checkpoint はJSON文字列で保存する
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS export_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                guild_id INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                params TEXT NOT NULL,
+                status TEXT NOT NULL,
+                checkpoint TEXT NOT NULL DEFAULT '{}',
+                error TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS export_jobs_guild ON export_jobs (guild_id, id)')
+        self.conn.commit()
+
+    def create(self, guild_id, kind, params):
+        """ジョブを登録してIDを返す"""
+        now = datetime.now(timezone.utc).isoformat()
+        cursor = self.conn.execute(
+            'INSERT INTO export_jobs (guild_id, kind, params, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+            (guild_id, kind, json.dumps(params), 'queued', now, now)
+        )
+        self.conn.commit()
+        return cursor.lastrowid
+
+    def update(self, job_id, status, checkpoint, error=None):
+        """状態とチェックポイントを更新"""
+        self.conn.execute(
+            'UPDATE export_jobs SET status = ?, checkpoint = ?, error = ?, updated_at = ? WHERE id = ?',
+            (status, json.dumps(checkpoint), error, datetime.now(timezone.utc).isoformat(), job_id)
+        )
+        self.conn.commit()
+
+    def get(self, job_id):
+        """(id, guild_id, kind, params, status, checkpoint, error, created_at) を返す（なければ None）"""
+        row = self.conn.execute(
+            'SELECT id, guild_id, kind, params, status, checkpoint, error, created_at FROM export_jobs WHERE id = ?',
+            (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return row[:3] + (json.loads(row[3]), row[4], json.loads(row[5])) + row[6:]
+
+    def recent(self, guild_id, limit=10):
+        """サーバーの最近のジョブを新しい順に (id, kind, status, created_at) で返す"""
+        return self.conn.execute(
+            'SELECT id, kind, status, created_at FROM export_jobs WHERE guild_id = ? ORDER BY id DESC LIMIT ?',
+            (guild_id, limit)
+        ).fetchall()
+
+    def unfinished(self):
+        """待機中・実行中のままのジョブを (id, guild_id) で返す（前回終了時に中断されたもの）"""
+        return self.conn.execute(
+            "SELECT id, guild_id FROM export_jobs WHERE status IN ('queued', 'running')"
+        ).fetchall()
+
+
+class AttachmentIndex:
+    """
+    保存済みの添付ファイル（添付ファイルID → SHA-256 のブロブ）を記録する
+    同じ添付ファイルを再びエクスポートしたときにダウンロードし直さないために使う
+    フォーマット: (sha256, size, filename, content_type)
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS attachment_blobs (
+                attachment_id INTEGER PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                filename TEXT NOT NULL,
+                content_type TEXT,
+                created_at TEXT NOT NULL
+            )
+        ''')
+        self.conn.commit()
+
+    def get(self, attachment_id):
+        """保存済みならブロブの情報を返す（なければ None）"""
+        return self.conn.execute(
+            'SELECT sha256, size, filename, content_type FROM attachment_blobs WHERE attachment_id = ?',
+            (attachment_id,)
+        ).fetchone()
+
+    def add(self, attachment_id, sha256, size, filename, content_type):
+        self.conn.execute(
+            'INSERT OR REPLACE INTO attachment_blobs (attachment_id, sha256, size, filename, content_type, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+            (attachment_id, sha256, size, filename, content_type, datetime.now(timezone.utc).isoformat())
+        )
+        self.conn.commit()
+
+
+class LoggingConfigStore:
+    """
+    継続ログ設定を保存する
+    フォーマット: (guild_id, log_server_id, log_channel_id, channels, mode)
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS logging_configs (
+                guild_id INTEGER PRIMARY KEY,
+                log_server_id INTEGER NOT NULL,
+                log_channel_id INTEGER NOT NULL,
+                channels TEXT NOT NULL,
+                mode TEXT NOT NULL DEFAULT 'embed'
+            )
+        ''')
+        # mode 列がない古いデータベースに列を追加
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(logging_configs)')}
+        if 'mode' not in columns:
+            self.conn.execute("ALTER TABLE logging_configs ADD COLUMN mode TEXT NOT NULL DEFAULT 'embed'")
+        self.conn.commit()
+
+    def load_all(self):
+        """保存されている全ての設定を返す（channels はチャンネルIDのリスト）"""
+        rows = self.conn.execute('SELECT guild_id, log_server_id, log_channel_id, channels, mode FROM logging_configs').fetchall()
+        return [
+            (guild_id, log_server_id, log_channel_id, [int(ch) for ch in channels.split(',') if ch], mode)
+            for guild_id, log_server_id, log_channel_id, channels, mode in rows
+        ]
+
+    def save(self, guild_id, log_server_id, log_channel_id, channels, mode='embed'):
+        """設定を保存（既にあれば上書き）"""
+        self.conn.execute(
+            'INSERT OR REPLACE INTO logging_configs (guild_id, log_server_id, log_channel_id, channels, mode) VALUES (?, ?, ?, ?, ?)',
+            (guild_id, log_server_id, log_channel_id, ','.join(str(ch) for ch in channels), mode)
+        )
+        self.conn.commit()
+
+    def delete(self, guild_id):
+        """設定を削除"""
+        self.conn.execute('DELETE FROM logging_configs WHERE guild_id = ?', (guild_id,))
+        self.conn.commit()
+
+
+# ローカルのメッセージアーカイブのパス
+ARCHIVE_PATH = os.getenv('ARCHIVE_DB_PATH', 'archive.db')
+# まとめて書き込むメッセージ数
+ARCHIVE_BATCH_SIZE = 500
+
+
+class MessageArchive:
+    """
+    継続ログとエクスポートで取得したメッセージのローカルアーカイブ
+    本文はFTS5（trigram）で全文検索できる。メッセージIDはSnowflakeなので期間検索は主キーの範囲で行う
+    書き込みは add() でためておき、flush() で1つのトランザクションにまとめる
+    """
+
+    def __init__(self, conn, batch_size=ARCHIVE_BATCH_SIZE):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.pending = []
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY,
+                guild_id INTEGER,
+                channel_id INTEGER NOT NULL,
+                author_id INTEGER NOT NULL,
+                channel TEXT,
+                author TEXT,
+                content TEXT,
+                timestamp TEXT,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS messages_channel ON messages (guild_id, channel_id, id);
+            CREATE INDEX IF NOT EXISTS messages_author ON messages (guild_id, author_id, id);
+        ''')
+        # 日本語を検索できるように trigram トークナイザーを使う（古いSQLiteでは unicode61）
+        try:
+            self._create_fts('trigram')
+        except sqlite3.OperationalError:
+            self._create_fts('unicode61')
+        self.conn.commit()
+
+    def _create_fts(self, tokenizer):
+        self.conn.executescript(f'''
+            CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                content, content='messages', content_rowid='id', tokenize='{tokenizer}'
+            );
+            CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+                INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+            END;
+            CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+                INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+            END;
+            CREATE TRIGGER IF NOT EXISTS messages_au AFTER UPDATE OF content ON messages BEGIN
+                INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+                INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+            END;
+        ''')
+
+    def add(self, record, data):
+        """
+        メッセージを追加（batch_size 件たまったら書き込む）
+        record は serializer の辞書、data はその encode_record 済みのバイト列
+        """
+        self.pending.append((
+            int(record['id']),
+            int(record['guild_id']) if record['guild_id'] else None,
+            int(record['channel_id']),
+            int(record['author_id']),
+            record['channel'],
+            record['author'],
+            record['content'],
+            record['timestamp'],
+            data.decode('utf-8'),
+        ))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """ためているメッセージを1つのトランザクションで書き込む"""
+        if not self.pending:
+            return
+        rows, self.pending = self.pending, []
+        with self.conn:
+            self.conn.executemany('''
+                INSERT INTO messages (id, guild_id, channel_id, author_id, channel, author, content, timestamp, data)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    channel = excluded.channel,
+                    author = excluded.author,
+                    content = excluded.content,
+                    data = excluded.data
+            ''', rows)
+
+    def search(self, guild_id, channel_id=None, author_id=None, after_id=None, before_id=None, text=None, limit=20):
+        """
+        条件に合うメッセージを新しい順に返す
+        フォーマット: [(id, channel_id, channel, author, content, timestamp)]
+        """
+        self.flush()
+        conditions = ['m.guild_id = ?']
+        params = [guild_id]
+        if channel_id is not None:
+            conditions.append('m.channel_id = ?')
+            params.append(channel_id)
+        if author_id is not None:
+            conditions.append('m.author_id = ?')
+            params.append(author_id)
+        if after_id is not None:
+            conditions.append('m.id > ?')
+            params.append(after_id)
+        if before_id is not None:
+            conditions.append('m.id < ?')
+            params.append(before_id)
+
+        source = 'messages m'
+        if text:
+            if len(text) >= 3:
+                # FTS5のフレーズ検索（trigram は3文字以上が必要）
+                source = 'messages_fts JOIN messages m ON m.id = messages_fts.rowid'
+                conditions.append('messages_fts MATCH ?')
+                params.append('"' + text.replace('"', '""') + '"')
+            else:
+                conditions.append("m.content LIKE ? ESCAPE '\\'")
+                params.append('%' + text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+
+        params.append(limit)
+        return self.conn.execute(f'''
+            SELECT m.id, m.channel_id, m.channel, m.author, m.content, m.timestamp
+            FROM {source}
+            WHERE {' AND '.join(conditions)}
+            ORDER BY m.id DESC
+            LIMIT ?
+        ''', params).fetchall()